@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import copy
+import glob
+import os
+import os.path
+import sys
+import timeit
+
+sys.path.append(os.path.realpath(os.path.dirname(__file__) + '/..'))
+
+import twnews.common
+from twnews.soup import NewsSoup, ENGINE_LIST
+from twnews.extract import select_nodes, node_own_text
+
+# 用離線範本比較各分解引擎的速度
+ROUNDS = 20
+samples = sorted(glob.glob(twnews.common.get_package_dir() + '/samples/*.html.xz'))
+
+def parse_all(engine):
+    for path in samples:
+        nsoup = NewsSoup(path, engine=engine)
+        nsoup.title()
+        nsoup.date()
+        nsoup.author()
+        nsoup.contents()
+
+print('分解引擎:')
+for engine in ENGINE_LIST:
+    elapsed = timeit.timeit(lambda: parse_all(engine), number=ROUNDS)
+    print('  {:6s} {:8.2f} ms/篇'.format(engine, elapsed * 1000 / ROUNDS / len(samples)))
+
+# 比較複製節點再丟棄子節點，與直接讀取直屬字串的速度
+def own_text_by_copy(node):
+    node = copy.copy(node)
+    for child_node in node.select('*'):
+        child_node.extract()
+    return node.text
+
+nodes = []
+for path in samples:
+    nsoup = NewsSoup(path)
+    nsoup.title()
+    for key in ['title_node', 'date_node', 'author_node']:
+        nsel = nsoup.conf[key]
+        if isinstance(nsel, str) and nsel != '':
+            nodes.extend(select_nodes(nsoup.soup, nsel)[:1])
+    # 整頁的 body 模擬子節點很多的情況
+    nodes.append(nsoup.soup.body)
+
+print('擷取節點本身的文字 ({} 個節點):'.format(len(nodes)))
+for (name, func) in [('copy', own_text_by_copy), ('direct', node_own_text)]:
+    elapsed = timeit.timeit(lambda: [func(node) for node in nodes], number=ROUNDS)
+    print('  {:6s} {:8.3f} ms'.format(name, elapsed * 1000 / ROUNDS))
@@ -28,9 +28,14 @@ setup(
         'beautifulsoup4>=4.7.1',
         'busm>=0.9.0',
         'lxml>=4.3.3',
+        'cssselect>=1.0.3',
         'requests>=2.21.0',
         'pandas>=0.24.2',
         'PyYAML>=5.1.2'
     ],
+    extras_require={
+        'async': ['aiohttp>=3.5.4'],
+        'arrow': ['pyarrow>=0.13.0']
+    },
     python_requires='>=3.5'
 )
@@ -6,9 +6,11 @@ import sys
 import locale
 import os.path
 from datetime import datetime
+import twnews.cache
 from twnews.common import get_logger, VERSION
 from twnews.soup import NewsSoup
-from twnews.search import NewsSearch
+from twnews.search import NewsSearch, SEARCH_CHANNELS
+from twnews.multisearch import MultiSearch
 
 def soup(path):
     """
@@ -76,7 +78,7 @@ def search_and_compare_performance(keyword):
     print('測試各新聞台搜尋效能')
     summary = {}
 
-    for channel in ['appledaily', 'cna', 'ettoday', 'ltn', 'setn', 'udn']:
+    for channel in SEARCH_CHANNELS:
         print()
         print(channel)
         print('-' * 60)
@@ -127,16 +129,38 @@ def compare_keyword(keyword):
         'udn': '  聯合'
     }
 
+    msearch = MultiSearch(
+        list(media.keys()),
+        beg_date=beg_date,
+        end_date=end_date,
+        limit=999,
+        cache=True
+    )
+    msearch.by_keyword(keyword, title_only=True)
+    counts = msearch.counts()
+    latency = msearch.latency()
     for (channel, name) in media.items():
-        nsearch = NewsSearch(
-            channel,
-            beg_date=beg_date,
-            end_date=end_date,
-            limit=999
-        )
-        results = nsearch.by_keyword(keyword, title_only=True).to_dict_list()
-        msg = '{}: {}'.format(name, len(results))
-        print(msg, flush=True)
+        if channel in msearch.errors():
+            print('{}: 搜尋失敗'.format(name))
+        else:
+            print('{}: {} ({:.3f} 秒)'.format(name, counts[channel], latency[channel]))
+    print('總耗時: {:.3f} 秒'.format(msearch.elapsed()))
+
+def recompress(codec, category):
+    """
+    轉換快取的壓縮方式
+    """
+    print('轉換快取壓縮方式為 {} (分類: {}) ...'.format(codec, category or '全部'))
+    count = twnews.cache.recompress(codec, category)
+    print('已轉換 {} 個快取檔'.format(count))
+
+def pack(category, codec):
+    """
+    快取檔匯入 packed store 並壓實
+    """
+    print('快取檔匯入 packed store (分類: {}) ...'.format(category or '全部'))
+    for (name, count) in twnews.cache.pack(category, codec).items():
+        print('{}: {} 個項目'.format(name, count))
 
 def usage():
     """
@@ -180,6 +204,14 @@ def main():
     elif action == 'cpkw':
         keyword = get_cmd_param(2, '酒駕')
         compare_keyword(keyword)
+    elif action == 'recompress':
+        codec = get_cmd_param(2, 'xz')
+        category = get_cmd_param(3)
+        recompress(codec, category)
+    elif action == 'pack':
+        category = get_cmd_param(2)
+        codec = get_cmd_param(3)
+        pack(category, codec)
     else:
         if action != 'help':
             print('動作名稱錯誤')
@@ -0,0 +1,99 @@
+"""
+新聞內容模組
+"""
+
+import json
+
+class NewsArticle:
+    """
+    分解後的新聞內容，只保存欄位不保存分解樹，大量保存時比 NewsSoup 省記憶體
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    __slots__ = (
+        'link',
+        'channel',
+        'title',
+        'date_raw',
+        'date',
+        'author',
+        'contents',
+        'text_rate'
+    )
+
+    def __init__(self, link, channel, title=None, date_raw=None, date=None,
+                 author=None, contents=None, text_rate=0):
+        """
+        建立新聞內容
+        """
+
+        # pylint: disable=too-many-arguments
+
+        self.link = link
+        self.channel = channel
+        self.title = title
+        self.date_raw = date_raw
+        self.date = date
+        self.author = author
+        self.contents = contents
+        self.text_rate = text_rate
+
+    def __repr__(self):
+        return 'NewsArticle({!r}, {!r})'.format(self.link, self.title)
+
+    def __eq__(self, other):
+        if not isinstance(other, NewsArticle):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __hash__(self):
+        # 與 __eq__ 比較相同的欄位，欄位修改後雜湊值也會改變，放進 set 或 dict 後不要再修改
+        return hash(tuple(getattr(self, name) for name in self.__slots__))
+
+    def to_dict(self):
+        """
+        轉換成 dict
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def to_json(self):
+        """
+        轉換成一行 JSON，日期使用 ISO 8601 格式
+        """
+        data = self.to_dict()
+        if data['date'] is not None:
+            data['date'] = data['date'].isoformat()
+        return json.dumps(data, ensure_ascii=False)
+
+def write_jsonl(articles, jsonl_file):
+    """
+    新聞內容寫入 JSON lines 檔案，jsonl_file 是已經開啟的文字檔，回傳寫入筆數
+    """
+    count = 0
+    for article in articles:
+        jsonl_file.write(article.to_json())
+        jsonl_file.write('\n')
+        count += 1
+    return count
+
+def to_columns(articles):
+    """
+    新聞內容轉換成欄位導向的 {欄位: list}，方便交給 pandas 或 Arrow
+    """
+    columns = {name: [] for name in NewsArticle.__slots__}
+    appenders = [(name, columns[name].append) for name in NewsArticle.__slots__]
+    for article in articles:
+        for (name, append) in appenders:
+            append(getattr(article, name))
+    return columns
+
+def to_arrow(articles):
+    """
+    新聞內容轉換成 pyarrow.Table
+
+    需要安裝 pyarrow
+    """
+    # pylint: disable=import-outside-toplevel, import-error
+    import pyarrow
+    return pyarrow.Table.from_pydict(to_columns(articles))
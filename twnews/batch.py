@@ -0,0 +1,148 @@
+"""
+批次分解模組
+"""
+
+import threading
+import collections
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import twnews.common
+from twnews.soup import NewsSoup, html_from_website
+from twnews.extract import ENGINE_DEFAULT
+
+# 批次分解時，各頻道同時下載的預設上限
+BATCH_CHANNEL_LIMIT = 4
+
+def _batch_fetch(path, refresh, proxy_first, engine, semaphore):
+    """
+    批次分解的下載階段，只負責轉址與下載，不建立 BeautifulSoup 物件
+
+    semaphore 已經在送出前取得，下載結束後釋放
+    """
+    try:
+        nsoup = NewsSoup(path, refresh=refresh, proxy_first=proxy_first, engine=engine)
+        if nsoup.channel != '' and nsoup.path.startswith('http') and not nsoup.fetched:
+            (nsoup.html, nsoup.rawlen, _) = html_from_website(
+                nsoup.path,
+                nsoup.channel,
+                nsoup.refresh,
+                nsoup.proxy_first
+            )
+            nsoup.fetched = True
+    finally:
+        semaphore.release()
+    return nsoup
+
+def _batch_parse(source, nsoup):
+    """
+    批次分解的分解階段，在 process pool 裡執行
+    """
+    fields = nsoup.extract_all(release=True)
+    if fields is None:
+        fields = dict.fromkeys(['title', 'date', 'author', 'contents'])
+    return {
+        'source': source,
+        'path': nsoup.path,
+        'channel': nsoup.channel,
+        'title': fields['title'],
+        'date': fields['date'],
+        'author': fields['author'],
+        'contents': fields['contents'],
+        'error': None
+    }
+
+def _batch_error(source, ex):
+    """
+    批次分解失敗的項目，欄位都是 None，error 記錄失敗原因
+    """
+    twnews.common.get_logger().error('批次分解失敗 %s: %s', source, ex)
+    return {
+        'source': source,
+        'path': source,
+        'channel': twnews.common.detect_channel(source),
+        'title': None,
+        'date': None,
+        'author': None,
+        'contents': None,
+        'error': ex
+    }
+
+def soup_batch(paths, refresh=False, proxy_first=False,
+               fetch_workers=8, parse_workers=None, channel_limit=BATCH_CHANNEL_LIMIT,
+               engine=ENGINE_DEFAULT):
+    """
+    批次分解新聞，以 thread pool 下載，process pool 分解，每完成一則就回傳一則
+
+    channel_limit 是各頻道同時下載的數量上限，可以是整數或是 {頻道: 上限} 的 dict，
+    各頻道排隊等待，取得名額後才送進 thread pool，慢的頻道不會占滿所有下載執行緒
+    paths 可以是 generator，依照下載進度逐步取用，例如邊搜尋邊分解
+    分解程序用 spawn 啟動，避免在下載執行緒運作中 fork 複製到鎖住的 lock
+    不支援的頻道或下載、分解失敗的項目不會中斷批次，回傳欄位為 None 並在 error 記錄例外
+    """
+
+    # pylint: disable=too-many-arguments, too-many-locals, too-many-statements
+
+    semaphores = {}
+    def get_semaphore(channel):
+        if channel not in semaphores:
+            if isinstance(channel_limit, dict):
+                limit = channel_limit.get(channel, BATCH_CHANNEL_LIMIT)
+            else:
+                limit = channel_limit
+            semaphores[channel] = threading.BoundedSemaphore(limit)
+        return semaphores[channel]
+
+    mp_context = multiprocessing.get_context('spawn')
+    with ThreadPoolExecutor(fetch_workers) as fetcher, \
+         ProcessPoolExecutor(parse_workers, mp_context=mp_context) as parser:
+        paths = iter(paths)
+        queues = {}
+        fetching = {}
+        parsing = {}
+
+        def dispatch(channel):
+            # 取得頻道名額的項目才送進 thread pool
+            queue = queues[channel]
+            semaphore = get_semaphore(channel)
+            while queue and semaphore.acquire(blocking=False):
+                path = queue.popleft()
+                future = fetcher.submit(_batch_fetch, path, refresh, proxy_first, engine, semaphore)
+                fetching[future] = path
+
+        while True:
+            # 排隊的項目不超過 fetch_workers * 2，先讀到的頻道名額滿了也會繼續讀取其他頻道
+            pulled = False
+            while sum(len(queue) for queue in queues.values()) < fetch_workers * 2:
+                path = next(paths, None)
+                if path is None:
+                    break
+                pulled = True
+                channel = twnews.common.detect_channel(path)
+                if channel == '':
+                    yield _batch_error(path, ValueError('不支援的新聞頻道'))
+                    continue
+                queues.setdefault(channel, collections.deque()).append(path)
+                dispatch(channel)
+            if not (fetching or parsing):
+                if pulled:
+                    continue
+                break
+            (done, _) = wait(set(fetching) | set(parsing), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in fetching:
+                    source = fetching.pop(future)
+                    dispatch(twnews.common.detect_channel(source))
+                    try:
+                        nsoup = future.result()
+                    except Exception as ex: # pylint: disable=broad-except
+                        yield _batch_error(source, ex)
+                        continue
+                    parsing[parser.submit(_batch_parse, source, nsoup)] = source
+                else:
+                    source = parsing.pop(future)
+                    try:
+                        entry = future.result()
+                    except Exception as ex: # pylint: disable=broad-except
+                        entry = _batch_error(source, ex)
+                    yield entry
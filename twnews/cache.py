@@ -2,9 +2,385 @@
 快取處理模組
 """
 
+import io
 import os
+import re
+import gzip
+import mmap
+import contextlib
 import lzma
 import json
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# 快取壓縮方式與副檔名，讀取時依照副檔名判斷壓縮方式，所以不同壓縮方式的快取可以混用
+CODEC_EXTENSIONS = {
+    'xz': '.xz',
+    'gz': '.gz',
+    'none': ''
+}
+CODEC_DEFAULT = 'xz'
+
+# gzip 壓縮等級，1 寫入最快，9 檔案最小
+GZIP_LEVEL = 1
+
+# recompress 處理的檔案，只限新聞與資料集快取
+CACHE_FILE_PATTERN = r'\.(html|json|csv|txt)(\.xz|\.gz)?$'
+
+# 快取儲存方式，files 是一個項目一個檔案，packed 是多個項目寫入同一個 segment 檔
+STORAGE_LIST = ['files', 'packed']
+STORAGE_DEFAULT = 'files'
+
+# packed store 的 segment 檔大小上限
+SEGMENT_LIMIT = 256 * 1024 * 1024
+
+# 轉址快取的有效期限 (秒) 與筆數上限
+REDIRECT_TTL = 30 * 86400
+REDIRECT_LIMIT = 1000000
+
+# 搜尋結果頁面快取的有效期限 (秒)，只用於還可能變動的頁面
+SEARCH_TTL = 300
+
+# pylint: disable=global-statement
+__REDIRECT_CACHE = None
+__ARTICLE_INDEX = None
+__SEARCH_CACHE = None
+__PACKED_STORES = {}
+__PACKED_STORES_LOCK = threading.Lock()
+__CACHE_CONF = None
+
+def get_cache_conf(section):
+    """
+    取得各快取分類的設定，可以用 ~/.twnews/cache.json 設定，例如
+
+    {
+        "codec": {"default": "xz", "udn": "gz", "twse": "none"},
+        "storage": {"default": "files", "udn": "packed"}
+    }
+    """
+    global __CACHE_CONF
+    if __CACHE_CONF is None:
+        cache_conf = {
+            'codec': {'default': CODEC_DEFAULT},
+            'storage': {'default': STORAGE_DEFAULT}
+        }
+        conf_path = os.path.expanduser('~/.twnews/cache.json')
+        if os.path.isfile(conf_path):
+            with open(conf_path, 'r') as conf_file:
+                user_conf = json.load(conf_file)
+            for (name, values) in cache_conf.items():
+                values.update(user_conf.get(name, {}))
+            check_cache_conf(cache_conf, conf_path)
+        __CACHE_CONF = cache_conf
+    return __CACHE_CONF[section]
+
+def check_cache_conf(cache_conf, conf_path):
+    """
+    檢查快取設定的壓縮方式與儲存方式，有不支援的值時一次列出
+    """
+    invalid = []
+    for (section, supported) in [('codec', CODEC_EXTENSIONS), ('storage', STORAGE_LIST)]:
+        for (category, value) in cache_conf[section].items():
+            if value not in supported:
+                invalid.append('{}.{}={}'.format(section, category, value))
+    if invalid:
+        msg = '{} 有不支援的快取設定: {}，壓縮方式限 {}，儲存方式限 {}'.format(
+            conf_path, ', '.join(invalid), '/'.join(CODEC_EXTENSIONS), '/'.join(STORAGE_LIST)
+        )
+        raise ValueError(msg)
+
+def get_codec(category):
+    """
+    取得快取分類的壓縮方式
+    """
+    codecs = get_cache_conf('codec')
+    return codecs.get(category, codecs['default'])
+
+def set_codec(category, codec):
+    """
+    設定快取分類的壓縮方式，category 為 default 時變更預設值
+    """
+    if codec not in CODEC_EXTENSIONS:
+        raise ValueError('不支援的壓縮方式: {}'.format(codec))
+    get_cache_conf('codec')[category] = codec
+
+def get_storage(category):
+    """
+    取得快取分類的儲存方式
+    """
+    storages = get_cache_conf('storage')
+    return storages.get(category, storages['default'])
+
+def set_storage(category, storage):
+    """
+    設定快取分類的儲存方式，category 為 default 時變更預設值
+    """
+    if storage not in STORAGE_LIST:
+        raise ValueError('不支援的儲存方式: {}'.format(storage))
+    get_cache_conf('storage')[category] = storage
+
+def get_codec_extension(category):
+    """
+    取得快取分類的壓縮副檔名
+    """
+    return CODEC_EXTENSIONS[get_codec(category)]
+
+def codec_of(path):
+    """
+    依照副檔名判斷壓縮方式
+    """
+    for (codec, ext) in CODEC_EXTENSIONS.items():
+        if ext != '' and path.endswith(ext):
+            return codec
+    return 'none'
+
+def strip_codec(path):
+    """
+    移除壓縮副檔名
+    """
+    ext = CODEC_EXTENSIONS[codec_of(path)]
+    if ext != '':
+        return path[:-len(ext)]
+    return path
+
+def open_cache_file(path, mode='rt'):
+    """
+    依照副檔名的壓縮方式開啟快取檔
+    """
+    codec = codec_of(path)
+    encoding = None if 'b' in mode else 'utf-8'
+    if codec == 'xz':
+        return lzma.open(path, mode, encoding=encoding)
+    if codec == 'gz':
+        return gzip.open(path, mode, compresslevel=GZIP_LEVEL, encoding=encoding)
+    return open(path, mode, encoding=encoding)
+
+def compress(data, codec):
+    """
+    依照壓縮方式壓縮 bytes
+    """
+    if codec == 'xz':
+        return lzma.compress(data)
+    if codec == 'gz':
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    return data
+
+def decompress(data, codec):
+    """
+    依照壓縮方式解壓縮 bytes
+    """
+    if codec == 'xz':
+        return lzma.decompress(data)
+    if codec == 'gz':
+        return gzip.decompress(data)
+    return data
+
+def find_cache_file(base_path, category=None):
+    """
+    尋找存在的快取檔，base_path 不含壓縮副檔名，優先使用分類目前的壓縮方式
+
+    項目存放在 packed store 時回傳 base_path，可以用 read_cache_text() 讀取
+    """
+    codecs = list(CODEC_EXTENSIONS)
+    if category is not None:
+        codecs.remove(get_codec(category))
+        codecs.insert(0, get_codec(category))
+    for codec in codecs:
+        path = base_path + CODEC_EXTENSIONS[codec]
+        if os.path.isfile(path):
+            return path
+
+    store = find_packed_store(os.path.dirname(base_path))
+    if store is not None and store.has(os.path.basename(base_path)):
+        return base_path
+
+    return None
+
+def read_cache_text(path):
+    """
+    讀取快取內容，檔案不存在時改從同目錄的 packed store 讀取
+    """
+    if os.path.isfile(path):
+        with open_cache_file(path, 'rt') as cache_file:
+            return cache_file.read()
+
+    text = None
+    store = find_packed_store(os.path.dirname(path))
+    if store is not None:
+        text = store.read(os.path.basename(strip_codec(path)))
+    if text is None:
+        raise FileNotFoundError('快取不存在: {}'.format(path))
+    return text
+
+@contextlib.contextmanager
+def map_region(path, offset=0, length=0):
+    """
+    用 mmap 對應檔案的一段區域，產生 memoryview，length 為 0 表示到檔案結尾
+
+    離開 with 區塊前必須釋放所有衍生的 memoryview
+    """
+    with open(path, 'rb') as map_file:
+        if length == 0:
+            length = os.fstat(map_file.fileno()).st_size - offset
+        if length <= 0:
+            yield b''
+            return
+        delta = offset % mmap.ALLOCATIONGRANULARITY
+        mapping = mmap.mmap(
+            map_file.fileno(),
+            length + delta,
+            access=mmap.ACCESS_READ,
+            offset=offset - delta
+        )
+        view = memoryview(mapping)[delta:]
+        try:
+            yield view
+        finally:
+            view.release()
+            mapping.close()
+
+@contextlib.contextmanager
+def map_cache_file(path):
+    """
+    取得快取內容的 bytes-like 物件，檔案不存在時改從同目錄的 packed store 讀取
+
+    沒壓縮的項目用 mmap 對應不複製資料，有壓縮的項目只解壓縮成 bytes 不解碼
+    """
+    if os.path.isfile(path):
+        if codec_of(path) == 'none':
+            with map_region(path) as data:
+                yield data
+        else:
+            with open_cache_file(path, 'rb') as cache_file:
+                yield cache_file.read()
+        return
+
+    store = find_packed_store(os.path.dirname(path))
+    if store is None:
+        raise FileNotFoundError('快取不存在: {}'.format(path))
+    with store.map(os.path.basename(strip_codec(path))) as data:
+        yield data
+
+@contextlib.contextmanager
+def open_cache_stream(path):
+    """
+    以 binary 串流開啟快取，有壓縮的檔案邊讀邊解壓縮
+
+    packed store 的項目沒有獨立檔案，改從 map_cache_file() 的內容建立串流
+    """
+    if os.path.isfile(path):
+        with open_cache_file(path, 'rb') as cache_file:
+            yield cache_file
+        return
+
+    with map_cache_file(path) as data:
+        stream = io.BytesIO(data)
+    yield stream
+
+def write_cache_text(path, text):
+    """
+    依照分類的儲存方式與壓縮方式寫入快取，分類就是快取檔所在的目錄名稱
+    """
+    cache_dir = os.path.dirname(path)
+    category = os.path.basename(cache_dir)
+    if get_storage(category) == 'packed':
+        key = os.path.basename(strip_codec(path))
+        get_packed_store(cache_dir).write(key, text, get_codec(category))
+        for ext in CODEC_EXTENSIONS.values():
+            if os.path.isfile(strip_codec(path) + ext):
+                os.unlink(strip_codec(path) + ext)
+    else:
+        with open_cache_file(path, 'wt') as cache_file:
+            cache_file.write(text)
+        remove_other_codecs(path)
+
+def remove_other_codecs(path):
+    """
+    刪除相同快取項目在其他壓縮方式的檔案，避免讀到舊資料
+    """
+    base_path = strip_codec(path)
+    for ext in CODEC_EXTENSIONS.values():
+        other_path = base_path + ext
+        if other_path != path and os.path.isfile(other_path):
+            os.unlink(other_path)
+
+def list_cache_dirs(category=None):
+    """
+    列出快取分類目錄，category 為 None 時列出所有分類
+    """
+    cache_root = os.path.expanduser('~/.twnews/cache')
+    if category is not None:
+        return [cache_root + '/' + category]
+    return [
+        cache_root + '/' + name for name in sorted(os.listdir(cache_root))
+        if os.path.isdir(cache_root + '/' + name)
+    ]
+
+def recompress_file(path, codec):
+    """
+    把一個快取檔轉換成指定的壓縮方式，回傳是否有轉換
+
+    先寫入同目錄的暫存檔再換成新檔名，中斷時不會留下不完整的快取檔
+    """
+    if codec_of(path) == codec:
+        return False
+    new_path = strip_codec(path) + CODEC_EXTENSIONS[codec]
+    try:
+        with open_cache_file(path, 'rb') as old_file:
+            content = old_file.read()
+    except FileNotFoundError:
+        # 其他程序已經轉換過
+        return False
+    (tmp_fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(tmp_fd, 'wb') as tmp_file:
+            tmp_file.write(compress(content, codec))
+        os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        os.replace(tmp_path, new_path)
+    except:
+        os.unlink(tmp_path)
+        raise
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    return True
+
+def recompress(codec, category=None, workers=None):
+    """
+    把 ~/.twnews/cache 的快取檔平行轉換成指定的壓縮方式，回傳轉換的檔案數
+
+    category 為 None 時處理所有分類
+    """
+    if codec not in CODEC_EXTENSIONS:
+        raise ValueError('不支援的壓縮方式: {}'.format(codec))
+
+    paths = []
+    for cache_dir in list_cache_dirs(category):
+        for filename in os.listdir(cache_dir):
+            if re.search(CACHE_FILE_PATTERN, filename):
+                paths.append(cache_dir + '/' + filename)
+
+    with ProcessPoolExecutor(workers) as executor:
+        converted = executor.map(recompress_file, paths, [codec] * len(paths), chunksize=64)
+        return sum(converted)
+
+def connect_cache_db(db_name, db_path=None):
+    """
+    開啟快取用的 SQLite 資料庫，預設位置是 ~/.twnews/cache/<db_name>.sqlite，可以跨執行緒共用
+    """
+    if db_path is None:
+        cache_dir = os.path.expanduser('~/.twnews/cache')
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        db_path = '{}/{}.sqlite'.format(cache_dir, db_name)
+    db_conn = sqlite3.connect(db_path, check_same_thread=False)
+    db_conn.execute('PRAGMA journal_mode=WAL')
+    db_conn.execute('PRAGMA synchronous=NORMAL')
+    return db_conn
 
 class DateCache:
     """
@@ -21,31 +397,53 @@ class DateCache:
 
     def get_path(self, datestr):
         """
-        產生快取檔路徑
+        產生快取檔路徑，副檔名依照分類的壓縮方式決定
         """
         cache_dir = os.path.expanduser('~/.twnews/cache/' + self.category)
         if not os.path.isdir(cache_dir):
             os.makedirs(cache_dir)
-        return '%s/%s-%s.%s.xz' % (cache_dir, self.item, datestr, self.data_format)
+        return '%s/%s-%s.%s%s' % (
+            cache_dir, self.item, datestr, self.data_format, get_codec_extension(self.category)
+        )
+
+    def find_path(self, datestr):
+        """
+        尋找存在的快取檔路徑，不限壓縮方式，不存在時回傳 None
+        """
+        return find_cache_file(strip_codec(self.get_path(datestr)), self.category)
 
     def has(self, datestr):
         """
         檢查快取檔是否存在
         """
-        cache_path = self.get_path(datestr)
-        return os.path.isfile(cache_path)
+        return self.find_path(datestr) is not None
+
+    def dates(self):
+        """
+        列出有快取的日期，包含 packed store 裡的項目，由舊到新排列
+        """
+        cache_dir = os.path.dirname(self.get_path(''))
+        pattern = r'{}-(\d+)\.{}$'.format(re.escape(self.item), re.escape(self.data_format))
+        names = [strip_codec(filename) for filename in os.listdir(cache_dir)]
+        store = find_packed_store(cache_dir)
+        if store is not None:
+            names.extend(store.keys())
+        dates = set()
+        for name in names:
+            match = re.match(pattern, name)
+            if match is not None:
+                dates.add(match.group(1))
+        return sorted(dates)
 
     def load(self, datestr):
         """
         載入快取檔
         """
         content = None
-        cache_path = self.get_path(datestr)
-        with lzma.open(cache_path, 'rt') as f_cache:
-            if self.data_format == 'json':
-                content = json.load(f_cache)
-            else:
-                content = f_cache.read()
+        cache_path = self.find_path(datestr) or self.get_path(datestr)
+        content = read_cache_text(cache_path)
+        if self.data_format == 'json':
+            content = json.loads(content)
         return content
 
     def save(self, datestr, content):
@@ -53,8 +451,433 @@ class DateCache:
         儲存快取檔
         """
         cache_path = self.get_path(datestr)
-        with lzma.open(cache_path, 'wt') as f_cache:
-            if self.data_format == 'json':
-                json.dump(content, f_cache)
+        if self.data_format == 'json':
+            content = json.dumps(content)
+        write_cache_text(cache_path, content)
+
+class RedirectCache:
+    """
+    轉址快取，記錄原始網址對應的最終網址
+    """
+
+    def __init__(self, db_path=None, ttl=REDIRECT_TTL, limit=REDIRECT_LIMIT):
+        """
+        建立轉址快取，資料存放在 SQLite
+        """
+        self.ttl = ttl
+        self.limit = limit
+        self.puts = 0
+        self.lock = threading.Lock()
+        self.db_conn = connect_cache_db('redirect', db_path)
+        self.db_conn.execute('''
+            CREATE TABLE IF NOT EXISTS `redirect` (
+                src TEXT PRIMARY KEY,
+                dest TEXT NOT NULL,
+                mtime REAL NOT NULL
+            )
+        ''')
+        self.db_conn.execute('''
+            CREATE INDEX IF NOT EXISTS `redirect_mtime` ON `redirect` (mtime)
+        ''')
+        self.db_conn.commit()
+
+    def get(self, url):
+        """
+        取得最終網址，沒有記錄或已過期時回傳 None
+        """
+        with self.lock:
+            row = self.db_conn.execute(
+                'SELECT dest, mtime FROM `redirect` WHERE src=?', (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[1] > self.ttl:
+                self.db_conn.execute('DELETE FROM `redirect` WHERE src=?', (url,))
+                self.db_conn.commit()
+                return None
+        return row[0]
+
+    def put(self, url, dest):
+        """
+        記錄最終網址，超過筆數上限時刪除最舊的記錄
+        """
+        with self.lock:
+            self.db_conn.execute(
+                'INSERT OR REPLACE INTO `redirect` (src, dest, mtime) VALUES (?,?,?)',
+                (url, dest, time.time())
+            )
+            self.db_conn.commit()
+            self.puts += 1
+            if self.puts % 1000 == 0:
+                self.__trim()
+
+    def __trim(self):
+        """
+        刪除超過筆數上限的舊記錄，呼叫前必須先取得 lock
+        """
+        count = self.db_conn.execute('SELECT COUNT(*) FROM `redirect`').fetchone()[0]
+        if count > self.limit:
+            self.db_conn.execute('''
+                DELETE FROM `redirect` WHERE src IN (
+                    SELECT src FROM `redirect` ORDER BY mtime LIMIT ?
+                )
+            ''', (count - self.limit,))
+            self.db_conn.commit()
+
+    def trim(self):
+        """
+        刪除超過筆數上限的舊記錄
+        """
+        with self.lock:
+            self.__trim()
+
+def get_redirect_cache():
+    """
+    取得轉址快取 如果已經存在就使用現有的
+    """
+    global __REDIRECT_CACHE
+    if __REDIRECT_CACHE is None:
+        __REDIRECT_CACHE = RedirectCache()
+    return __REDIRECT_CACHE
+
+class ArticleIndex:
+    """
+    新聞快取索引，原始網址、正規化網址、最終網址都對應到同一個快取項目
+    """
+
+    def __init__(self, db_path=None):
+        """
+        建立新聞快取索引，資料存放在 SQLite
+        """
+        self.lock = threading.Lock()
+        self.db_conn = connect_cache_db('article', db_path)
+        self.db_conn.execute('''
+            CREATE TABLE IF NOT EXISTS `article` (
+                url TEXT PRIMARY KEY,
+                channel TEXT NOT NULL,
+                final_url TEXT NOT NULL,
+                cache_id TEXT NOT NULL
+            )
+        ''')
+        self.db_conn.commit()
+
+    def get(self, url):
+        """
+        取得 (頻道, 最終網址, 快取代號)，沒有記錄時回傳 None
+        """
+        with self.lock:
+            row = self.db_conn.execute(
+                'SELECT channel, final_url, cache_id FROM `article` WHERE url=?', (url,)
+            ).fetchone()
+        return row
+
+    def put(self, urls, channel, final_url, cache_id):
+        """
+        記錄多個網址對應的快取項目
+        """
+        with self.lock:
+            for url in set(urls):
+                self.db_conn.execute(
+                    'INSERT OR REPLACE INTO `article` VALUES (?,?,?,?)',
+                    (url, channel, final_url, cache_id)
+                )
+            self.db_conn.commit()
+
+def get_article_index():
+    """
+    取得新聞快取索引 如果已經存在就使用現有的
+    """
+    global __ARTICLE_INDEX
+    if __ARTICLE_INDEX is None:
+        __ARTICLE_INDEX = ArticleIndex()
+    return __ARTICLE_INDEX
+
+class SearchCache:
+    """
+    搜尋結果頁面快取，以 (頻道, 關鍵字, 開始日期, 結束日期, 頁數) 記錄回應內容
+
+    不會再變動的頁面永久保存，其他頁面超過有效期限後視為不存在
+    """
+
+    def __init__(self, db_path=None, ttl=SEARCH_TTL):
+        """
+        建立搜尋結果頁面快取，資料存放在 SQLite
+        """
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.db_conn = connect_cache_db('search', db_path)
+        self.db_conn.execute('''
+            CREATE TABLE IF NOT EXISTS `search_page` (
+                channel TEXT NOT NULL,
+                keyword TEXT NOT NULL,
+                beg_date TEXT NOT NULL,
+                end_date TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                ctype TEXT NOT NULL,
+                body TEXT NOT NULL,
+                expire REAL,
+                PRIMARY KEY (channel, keyword, beg_date, end_date, page)
+            )
+        ''')
+        self.db_conn.commit()
+
+    def get(self, key):
+        """
+        取得 (Content-Type, 回應內容)，沒有記錄或已過期時回傳 None
+
+        key 是 (頻道, 關鍵字, 開始日期, 結束日期, 頁數)，沒有日期範圍時日期用空字串
+        """
+        with self.lock:
+            row = self.db_conn.execute('''
+                SELECT ctype, body, expire FROM `search_page`
+                WHERE channel=? AND keyword=? AND beg_date=? AND end_date=? AND page=?
+            ''', key).fetchone()
+        if row is None or (row[2] is not None and row[2] < time.time()):
+            return None
+        return (row[0], row[1])
+
+    def put(self, key, ctype, body, immutable=False):
+        """
+        記錄回應內容，body 可以是 str 或 bytes，immutable 為 True 時永久保存
+        """
+        expire = None if immutable else time.time() + self.ttl
+        with self.lock:
+            self.db_conn.execute(
+                'INSERT OR REPLACE INTO `search_page` VALUES (?,?,?,?,?,?,?,?)',
+                tuple(key) + (ctype, body, expire)
+            )
+            self.db_conn.commit()
+
+    def trim(self):
+        """
+        刪除過期的記錄
+        """
+        with self.lock:
+            self.db_conn.execute(
+                'DELETE FROM `search_page` WHERE expire < ?', (time.time(),)
+            )
+            self.db_conn.commit()
+
+def get_search_cache():
+    """
+    取得搜尋結果頁面快取 如果已經存在就使用現有的
+    """
+    global __SEARCH_CACHE
+    if __SEARCH_CACHE is None:
+        __SEARCH_CACHE = SearchCache()
+    return __SEARCH_CACHE
+
+class PackedStore:
+    """
+    一個快取分類的 packed store
+
+    項目內容個別壓縮後附加到 segment 檔，索引記錄項目所在的 segment、位置與長度
+    同一時間只能有一個程序寫入
+    """
+
+    def __init__(self, cache_dir):
+        """
+        開啟 packed store，segment 檔與索引都放在快取目錄裡
+        """
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()
+        self.db_conn = connect_cache_db('pack', cache_dir + '/pack.sqlite')
+        self.db_conn.execute('''
+            CREATE TABLE IF NOT EXISTS `record` (
+                key TEXT PRIMARY KEY,
+                segment INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                codec TEXT NOT NULL
+            )
+        ''')
+        self.db_conn.commit()
+        segments = self.segments()
+        self.segment = segments[-1] if segments else 1
+
+    def segment_path(self, segment):
+        """
+        產生 segment 檔路徑
+        """
+        return '{}/pack-{:05d}.seg'.format(self.cache_dir, segment)
+
+    def segments(self):
+        """
+        列出現有的 segment 編號
+        """
+        segments = []
+        for filename in os.listdir(self.cache_dir):
+            match = re.match(r'pack-(\d{5})\.seg$', filename)
+            if match is not None:
+                segments.append(int(match.group(1)))
+        return sorted(segments)
+
+    def has(self, key):
+        """
+        檢查項目是否存在
+        """
+        with self.lock:
+            row = self.db_conn.execute(
+                'SELECT 1 FROM `record` WHERE key=?', (key,)
+            ).fetchone()
+        return row is not None
+
+    def keys(self):
+        """
+        列出所有項目
+        """
+        with self.lock:
+            rows = self.db_conn.execute('SELECT key FROM `record`').fetchall()
+        return [row[0] for row in rows]
+
+    def read(self, key):
+        """
+        讀取項目內容，不存在時回傳 None
+        """
+        with self.lock:
+            row = self.db_conn.execute(
+                'SELECT segment, offset, length, codec FROM `record` WHERE key=?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            (segment, offset, length, codec) = row
+            with open(self.segment_path(segment), 'rb') as seg_file:
+                seg_file.seek(offset)
+                data = seg_file.read(length)
+        return decompress(data, codec).decode('utf-8')
+
+    @contextlib.contextmanager
+    def map(self, key):
+        """
+        取得項目內容的 bytes-like 物件，沒壓縮的項目用 mmap 對應 segment 檔
+
+        查詢位置到完成 mmap 或讀取都持有 lock，避免 compact() 在中間刪除 segment 檔，
+        mmap 建立後檔案被刪除也不影響對應的內容
+        """
+        with contextlib.ExitStack() as stack:
+            with self.lock:
+                row = self.db_conn.execute(
+                    'SELECT segment, offset, length, codec FROM `record` WHERE key=?', (key,)
+                ).fetchone()
+                if row is None:
+                    raise FileNotFoundError('快取不存在: {}/{}'.format(self.cache_dir, key))
+                (segment, offset, length, codec) = row
+                if codec == 'none':
+                    data = stack.enter_context(
+                        map_region(self.segment_path(segment), offset, length)
+                    )
+                else:
+                    with open(self.segment_path(segment), 'rb') as seg_file:
+                        seg_file.seek(offset)
+                        data = seg_file.read(length)
+            if codec == 'none':
+                yield data
             else:
-                f_cache.write(content)
+                yield decompress(data, codec)
+
+    def __append(self, data):
+        """
+        附加資料到目前的 segment 檔，回傳 (segment, 位置)，呼叫前必須先取得 lock
+        """
+        path = self.segment_path(self.segment)
+        if os.path.isfile(path) and os.path.getsize(path) >= SEGMENT_LIMIT:
+            self.segment += 1
+            path = self.segment_path(self.segment)
+        with open(path, 'ab') as seg_file:
+            offset = seg_file.tell()
+            seg_file.write(data)
+        return (self.segment, offset)
+
+    def write(self, key, text, codec=CODEC_DEFAULT):
+        """
+        寫入項目，舊的內容會留在 segment 檔裡，等壓實時清除
+        """
+        data = compress(text.encode('utf-8'), codec)
+        with self.lock:
+            (segment, offset) = self.__append(data)
+            self.db_conn.execute(
+                'INSERT OR REPLACE INTO `record` VALUES (?,?,?,?,?)',
+                (key, segment, offset, len(data), codec)
+            )
+            self.db_conn.commit()
+
+    def compact(self, codec=None):
+        """
+        壓實，把有效項目搬到新的 segment 檔，再刪除舊的 segment 檔，回傳項目數
+
+        有指定 codec 時順便轉換壓縮方式
+        """
+        with self.lock:
+            old_segments = self.segments()
+            if not old_segments:
+                return 0
+            self.segment = old_segments[-1] + 1
+            rows = self.db_conn.execute(
+                'SELECT key, segment, offset, length, codec FROM `record` ORDER BY segment, offset'
+            ).fetchall()
+            for (key, segment, offset, length, old_codec) in rows:
+                with open(self.segment_path(segment), 'rb') as seg_file:
+                    seg_file.seek(offset)
+                    data = seg_file.read(length)
+                new_codec = old_codec
+                if codec is not None and codec != old_codec:
+                    data = compress(decompress(data, old_codec), codec)
+                    new_codec = codec
+                (new_segment, new_offset) = self.__append(data)
+                self.db_conn.execute(
+                    'UPDATE `record` SET segment=?, offset=?, length=?, codec=? WHERE key=?',
+                    (new_segment, new_offset, len(data), new_codec, key)
+                )
+            self.db_conn.commit()
+            for segment in old_segments:
+                os.unlink(self.segment_path(segment))
+        return len(rows)
+
+    def import_files(self, remove=True):
+        """
+        匯入目錄裡一個項目一個檔案的快取，回傳匯入的項目數
+        """
+        count = 0
+        for filename in sorted(os.listdir(self.cache_dir)):
+            if re.search(CACHE_FILE_PATTERN, filename) is None:
+                continue
+            path = self.cache_dir + '/' + filename
+            with open_cache_file(path, 'rt') as cache_file:
+                text = cache_file.read()
+            self.write(strip_codec(filename), text, codec_of(path))
+            if remove:
+                os.unlink(path)
+            count += 1
+        return count
+
+def find_packed_store(cache_dir):
+    """
+    取得目錄裡已經存在的 packed store，不存在時回傳 None
+    """
+    if cache_dir == '':
+        cache_dir = '.'
+    if cache_dir not in __PACKED_STORES and not os.path.isfile(cache_dir + '/pack.sqlite'):
+        return None
+    return get_packed_store(cache_dir)
+
+def get_packed_store(cache_dir):
+    """
+    取得目錄的 packed store 如果已經開啟就使用現有的
+    """
+    with __PACKED_STORES_LOCK:
+        if cache_dir not in __PACKED_STORES:
+            __PACKED_STORES[cache_dir] = PackedStore(cache_dir)
+        return __PACKED_STORES[cache_dir]
+
+def pack(category=None, codec=None):
+    """
+    把快取檔匯入 packed store 並壓實，回傳 {分類: 項目數}
+
+    category 為 None 時處理所有分類
+    """
+    summary = {}
+    for cache_dir in list_cache_dirs(category):
+        store = get_packed_store(cache_dir)
+        store.import_files()
+        summary[os.path.basename(cache_dir)] = store.compact(codec)
+    return summary
@@ -2,16 +2,22 @@
 twnews 共用項目
 """
 
+import asyncio
 import json
 import os
 import os.path
 import logging
 import logging.config
 import socket
+import threading
+import urllib.parse
+import weakref
 import yaml
 
 import requests
 import requests.packages.urllib3.util.connection as urllib3_conn
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
 # 強制 requests 使用 IPv4
 urllib3_conn.allowed_gai_family = lambda: socket.AF_INET
@@ -23,9 +29,134 @@ __SESSION = {
     "direct": None,
     "proxy": None
 }
+__SESSION_LOCK = threading.Lock()
+# 每個 event loop 各自的 aiohttp session，換 event loop 時不會丟下舊的 session
+__ASYNC_SESSIONS = weakref.WeakKeyDictionary()
 
 VERSION = '0.3.3'
 
+HTTP_HEADERS = {
+    "Accept": "text/html,application/xhtml+xml,application/xml",
+    "Accept-Encoding": "gzip, deflate",
+    "Accept-Language": "zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7",
+    "Cache-Control": "max-age=0",
+    "Connection": "keep-alive",
+    "User-Agent": 'Mozilla/5.0 (Linux; Android 4.0.4; Galaxy Nexus Build/IMM76B) ' \
+        + 'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/46.0.2490.76 Mobile Safari/537.36'
+}
+
+# 非同步連線池上限 (全部 / 每個主機)
+ASYNC_POOL_LIMIT = 100
+ASYNC_POOL_LIMIT_PER_HOST = 10
+
+# requests 連線池保留的主機數，與每個主機的連線數上限
+POOL_CONNECTIONS = 32
+POOL_MAXSIZE = 16
+
+# 個別主機的連線數上限，可以用 set_pool_size() 設定
+HOST_POOL_SIZES = {}
+
+# 讀取失敗或回應這些狀態碼時重試，等待時間依照 RETRY_BACKOFF 指數增加
+# 連不上主機 (含 DNS 失敗) 不重試，離線時不必等完整個退避時間
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+class PooledAdapter(HTTPAdapter):
+    """
+    有重試機制的 HTTPAdapter，每個主機同時連線數不超過連線池大小，並記錄連線池統計
+
+    超過連線數的請求會等待空出的連線，而不是建立用完即丟的新連線
+    stream=True 的回應在關閉之前都占用連線，使用完畢必須呼叫 close()
+    """
+
+    def __init__(self, maxsize=POOL_MAXSIZE):
+        retry = Retry(
+            total=RETRY_TOTAL,
+            connect=0,
+            backoff_factor=RETRY_BACKOFF,
+            status_forcelist=RETRY_STATUS,
+            raise_on_status=False
+        )
+        super().__init__(pool_connections=POOL_CONNECTIONS, pool_maxsize=maxsize, max_retries=retry)
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.slots = {}
+        self.waits = {}
+
+    def send(self, request, **kwargs):
+        # pylint: disable=arguments-differ
+        host = urllib.parse.urlsplit(request.url).netloc
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.maxsize)
+                self.waits[host] = 0
+            slot = self.slots[host]
+        if not slot.acquire(blocking=False):
+            with self.lock:
+                self.waits[host] += 1
+            slot.acquire()
+        try:
+            resp = super().send(request, **kwargs)
+        except:
+            slot.release()
+            raise
+        if kwargs.get('stream'):
+            # 內容還沒讀取，連線要等回應關閉後才會回到連線池
+            resp.close = self.__release_on_close(resp.close, slot)
+            return resp
+        try:
+            # 讀完內容連線才會回到連線池，否則下一個請求會另外建立連線
+            resp.content # pylint: disable=pointless-statement
+        finally:
+            slot.release()
+        return resp
+
+    @staticmethod
+    def __release_on_close(close, slot):
+        """
+        包裝回應的 close()，第一次關閉時釋放連線數
+        """
+        released = []
+
+        def release_close():
+            try:
+                close()
+            finally:
+                if not released:
+                    released.append(True)
+                    slot.release()
+
+        return release_close
+
+    def stats(self):
+        """
+        連線池統計 {主機: {requests, connections, reuse_rate, waits}}
+
+        requests 包含重試，connections 是建立過的連線數，waits 是等待空出連線的次數
+        """
+        result = {}
+        managers = [self.poolmanager] + list(self.proxy_manager.values())
+        for manager in managers:
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                host = pool.host if pool.port in (None, 80, 443) else \
+                    '{}:{}'.format(pool.host, pool.port)
+                entry = result.setdefault(host, {'requests': 0, 'connections': 0})
+                entry['requests'] += pool.num_requests
+                entry['connections'] += pool.num_connections
+        with self.lock:
+            for (host, waits) in self.waits.items():
+                entry = result.setdefault(host, {'requests': 0, 'connections': 0})
+                entry['waits'] = waits
+        for entry in result.values():
+            entry.setdefault('waits', 0)
+            reused = entry['requests'] - entry['connections']
+            entry['reuse_rate'] = reused / entry['requests'] if entry['requests'] > 0 else 0
+        return result
+
 def found_socks5():
     """
     檢查是否有 SOCKS 5 Proxy
@@ -77,6 +208,8 @@ def get_logger(name='news'):
 def get_session(proxy_first):
     """
     取得 requests session 如果已經存在就使用現有的
+
+    多執行緒同時呼叫時只會建立一個 session，所有執行緒共用連線池
     """
     global __SESSION
     logger = get_logger('common')
@@ -87,29 +220,110 @@ def get_session(proxy_first):
     else:
         session_type = 'direct'
 
-    if __SESSION[session_type] is None:
-        logger.debug('建立新的 session')
-        user_agent = 'Mozilla/5.0 (Linux; Android 4.0.4; Galaxy Nexus Build/IMM76B) ' \
-            + 'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/46.0.2490.76 Mobile Safari/537.36'
-        __SESSION[session_type] = requests.Session()
-        __SESSION[session_type].headers.update({
-            "Accept": "text/html,application/xhtml+xml,application/xml",
-            "Accept-Encoding": "gzip, deflate",
-            "Accept-Language": "zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7",
-            "Cache-Control": "max-age=0",
-            "Connection": "keep-alive",
-            "User-Agent": user_agent
-        })
-        if session_type == 'proxy':
-            __SESSION[session_type].proxies = {
-                'http': 'socks5h://localhost:9050',
-                'https': 'socks5h://localhost:9050'
-            }
-    else:
-        logger.debug('使用現有 session')
+    with __SESSION_LOCK:
+        if __SESSION[session_type] is None:
+            logger.debug('建立新的 session')
+            session = requests.Session()
+            session.headers.update(HTTP_HEADERS)
+            if session_type == 'proxy':
+                session.proxies = {
+                    'http': 'socks5h://localhost:9050',
+                    'https': 'socks5h://localhost:9050'
+                }
+            adapter = PooledAdapter()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            for (host, maxsize) in HOST_POOL_SIZES.items():
+                __mount_host(session, host, maxsize)
+            __SESSION[session_type] = session
+        else:
+            logger.debug('使用現有 session')
 
     return __SESSION[session_type]
 
+def __mount_host(session, host, maxsize):
+    """
+    個別主機使用獨立的連線池
+    """
+    adapter = PooledAdapter(maxsize)
+    session.mount('http://{}/'.format(host), adapter)
+    session.mount('https://{}/'.format(host), adapter)
+
+def set_pool_size(host, maxsize):
+    """
+    設定個別主機的連線數上限，已經建立的 session 也會套用
+    """
+    with __SESSION_LOCK:
+        HOST_POOL_SIZES[host] = maxsize
+        for session in __SESSION.values():
+            if session is not None:
+                __mount_host(session, host, maxsize)
+
+def pool_stats(proxy_first=False):
+    """
+    取得 requests session 的連線池統計 {主機: {requests, connections, reuse_rate, waits}}
+
+    reuse_rate 是沿用既有連線的請求比例，還沒有建立 session 時回傳空的 dict
+    """
+    session_type = 'proxy' if proxy_first else 'direct'
+    session = __SESSION[session_type]
+    result = {}
+    if session is None:
+        return result
+    adapters = []
+    for adapter in session.adapters.values():
+        if isinstance(adapter, PooledAdapter) and adapter not in adapters:
+            adapters.append(adapter)
+    for adapter in adapters:
+        for (host, stats) in adapter.stats().items():
+            if host not in result:
+                result[host] = stats
+                continue
+            entry = result[host]
+            for name in ['requests', 'connections', 'waits']:
+                entry[name] += stats[name]
+            reused = entry['requests'] - entry['connections']
+            entry['reuse_rate'] = reused / entry['requests'] if entry['requests'] > 0 else 0
+    return result
+
+def get_async_session(proxy_first):
+    """
+    取得目前 event loop 的 aiohttp session 如果已經建立過就使用現有的
+
+    需要安裝 aiohttp，必須在 event loop 裡面呼叫，event loop 結束前用 close_async_session() 關閉
+    """
+    # pylint: disable=import-outside-toplevel
+    import aiohttp
+
+    logger = get_logger('common')
+
+    if proxy_first:
+        logger.warning('非同步連線不支援 SOCKS 5 proxy，改為直接連線')
+
+    loop = asyncio.get_event_loop()
+    session = __ASYNC_SESSIONS.get(loop)
+    if session is None or session.closed:
+        logger.debug('建立新的非同步 session')
+        connector = aiohttp.TCPConnector(
+            limit=ASYNC_POOL_LIMIT,
+            limit_per_host=ASYNC_POOL_LIMIT_PER_HOST,
+            family=socket.AF_INET
+        )
+        session = aiohttp.ClientSession(connector=connector, headers=HTTP_HEADERS)
+        __ASYNC_SESSIONS[loop] = session
+    else:
+        logger.debug('使用現有非同步 session')
+
+    return session
+
+async def close_async_session():
+    """
+    關閉目前 event loop 的 aiohttp session，event loop 結束前呼叫
+    """
+    session = __ASYNC_SESSIONS.pop(asyncio.get_event_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
 def get_all_conf():
     """
     取得完整設定
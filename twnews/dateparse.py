@@ -0,0 +1,131 @@
+"""
+日期解析模組
+"""
+
+import re
+from datetime import datetime
+
+# 可以轉換成 regex 的 strptime 指令，規則與 datetime.strptime 相同
+DIRECTIVE_PATTERNS = {
+    'Y': r'(?P<Y>\d\d\d\d)',
+    'y': r'(?P<y>\d\d)',
+    'm': r'(?P<m>1[0-2]|0[1-9]|[1-9])',
+    'd': r'(?P<d>3[01]|[12]\d|0[1-9]|[1-9]| [1-9])',
+    'H': r'(?P<H>2[0-3]|[0-1]\d|\d)',
+    'M': r'(?P<M>[0-5]\d|\d)',
+    'S': r'(?P<S>6[0-1]|[0-5]\d|\d)',
+    '%': '%'
+}
+
+# 各頻道/版面的日期解析器
+__PARSERS = {}
+
+def compile_format(fmt):
+    """
+    strptime 格式轉換成解析函數，解析失敗時回傳 None
+
+    格式包含 %b 這類與語系有關的指令時，改用 datetime.strptime 處理
+    """
+    pattern = ''
+    pos = 0
+    for match in re.finditer(r'%(.)|\s+', fmt):
+        pattern += re.escape(fmt[pos:match.start()])
+        if match.group(1) is None:
+            pattern += r'\s+'
+        elif match.group(1) in DIRECTIVE_PATTERNS:
+            pattern += DIRECTIVE_PATTERNS[match.group(1)]
+        else:
+            return __strptime_parser(fmt)
+        pos = match.end()
+    pattern += re.escape(fmt[pos:])
+
+    try:
+        pobj = re.compile(pattern, re.IGNORECASE)
+    except re.error:
+        # 重複的指令無法轉換成 regex
+        return __strptime_parser(fmt)
+
+    def parse(text):
+        match = pobj.fullmatch(text)
+        if match is None:
+            return None
+        fields = match.groupdict()
+        if fields.get('y') is not None:
+            year = int(fields['y'])
+            year += 2000 if year <= 68 else 1900
+        else:
+            year = int(fields.get('Y') or 1900)
+        try:
+            return datetime(
+                year,
+                int(fields.get('m') or 1),
+                int(fields.get('d') or 1),
+                int(fields.get('H') or 0),
+                int(fields.get('M') or 0),
+                int(fields.get('S') or 0)
+            )
+        except ValueError:
+            # 2 月 30 日這類不存在的日期
+            return None
+
+    return parse
+
+def __strptime_parser(fmt):
+    """
+    使用 datetime.strptime 的解析函數
+    """
+    def parse(text):
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            return None
+    return parse
+
+class DateParser:
+    """
+    多格式日期解析器
+
+    依序嘗試各格式，找到第一個符合的格式就停止，並且記住這個格式，下次優先使用
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, formats):
+        if isinstance(formats, str):
+            formats = [formats]
+        self.formats = list(formats)
+        self.parsers = [compile_format(fmt) for fmt in self.formats]
+        self.last = 0
+
+    def parse(self, text):
+        """
+        解析日期，所有格式都不符合時產生 ValueError
+        """
+        if not isinstance(text, str):
+            raise TypeError('日期必須是字串: {}'.format(text))
+
+        last = self.last
+        if last < len(self.parsers):
+            date_inst = self.parsers[last](text)
+            if date_inst is not None:
+                return date_inst
+
+        for (idx, parser) in enumerate(self.parsers):
+            if idx != last:
+                date_inst = parser(text)
+                if date_inst is not None:
+                    self.last = idx
+                    return date_inst
+
+        raise ValueError('日期 "{}" 不符合格式 {}'.format(text, self.formats))
+
+def get_date_parser(channel, layout, formats):
+    """
+    取得頻道/版面的日期解析器，如果已經存在就使用現有的
+    """
+    key = (channel, layout)
+    parser = __PARSERS.get(key)
+    if parser is None:
+        parser = DateParser(formats)
+        __PARSERS[key] = parser
+    return parser
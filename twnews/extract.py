@@ -0,0 +1,232 @@
+"""
+新聞節點擷取模組，提供 bs4 與 lxml 兩種分解引擎共用的選取與文字擷取方法
+"""
+
+import io
+import re
+import functools
+
+import lxml.etree
+import soupsieve
+from bs4 import BeautifulSoup
+from bs4.element import NavigableString, PreformattedString, CData
+from cssselect import HTMLTranslator
+
+# 分解引擎，bs4 建立 BeautifulSoup 物件，lxml 直接以預先編譯的 XPath 查詢 lxml 的樹
+ENGINE_LIST = ['bs4', 'lxml']
+ENGINE_DEFAULT = 'bs4'
+
+# 部分分解模式每次讀取的大小，每讀一段就檢查一次需要的節點是否都已經結束
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# 從內文找記者姓名的規則 (pattern, 姓名的 group)，依照順序比對，第一個符合的規則有效
+AUTHOR_PATTERNS = tuple((re.compile(patt), gidx) for (patt, gidx) in [
+    (r'(記者|中心)(\w{2,5})[/／╱](.+報導|特稿)', 2),
+    (r'文[/／╱]記者(\w{2,5})', 1),
+    (r'[\(（](\w{2,5})[/／╱].+報導[\)）]', 1),
+    (r'記者(\w{2,3}).{2}[縣市]?\d{1,2}日電', 1),
+    (r'(記者|遊戲角落 )(\w{2,5})$', 2),
+    (r'\s(\w{2,5})[/／╱].+報導$', 1),
+    (r'（譯者：(\w{2,5})/.+）', 1),
+    (r'【(\w{2,5})╱.+報導】', 1)
+])
+
+# 規則的 group(1) 是這些字時不是記者姓名
+AUTHOR_EXCLUDE = frozenset([
+    '國際中心',
+    '地方中心',
+    '社會中心',
+    '攝影'
+])
+
+# script、style、template 的內容與 bs4 的 .text 一樣略過
+__XPATH_TEXT = lxml.etree.XPath(
+    'descendant::text()[not(ancestor::script or ancestor::style or ancestor::template)]',
+    smart_strings=False
+)
+__XPATH_OWN_TEXT = lxml.etree.XPath('text()', smart_strings=False)
+__ASCII_SPACES = str.maketrans('', '', '\x20\x0a\x09\x0c\x0d')
+
+@functools.lru_cache(maxsize=None)
+def compile_selector(css, relative=False):
+    """
+    CSS selector 編譯成 lxml XPath 物件，同一個 selector 只編譯一次
+
+    relative 為 True 時只找子孫節點，不包含節點本身，與 bs4 的 Tag.select() 相同
+    """
+    prefix = 'descendant::' if relative else 'descendant-or-self::'
+    return lxml.etree.XPath(HTMLTranslator().css_to_xpath(css, prefix=prefix), smart_strings=False)
+
+def select_nodes(soup, css, engine=ENGINE_DEFAULT):
+    """
+    以 CSS selector 找出節點
+    """
+    if engine == 'lxml':
+        return compile_selector(css)(soup)
+    return soup.select(css)
+
+def select_many(soup, selectors, engine=ENGINE_DEFAULT):
+    """
+    一次找出多個 CSS selector 的節點，回傳 {selector: 節點 list}
+
+    bs4 引擎把全部 selector 合併成一個 selector list，只走訪一次樹，
+    再逐一比對找到的節點屬於哪些 selector
+    """
+    selectors = list(dict.fromkeys(selectors))
+    if engine == 'lxml':
+        return {css: compile_selector(css)(soup) for css in selectors}
+
+    found = {css: [] for css in selectors}
+    if not selectors:
+        return found
+    matchers = [(css, soupsieve.compile(css)) for css in selectors]
+    for node in soupsieve.select(', '.join(selectors), soup):
+        for (css, matcher) in matchers:
+            if matcher.match(node):
+                found[css].append(node)
+    return found
+
+def join_text(strings):
+    """
+    串接 lxml 的文字節點，空白處理方式與 BeautifulSoup 相同
+
+    BeautifulSoup 會把只有空白的字串縮成一個換行或一個空格
+    """
+    joined = io.StringIO()
+    for text in strings:
+        if text.translate(__ASCII_SPACES) == '':
+            text = '\n' if '\n' in text else ' '
+        joined.write(text)
+    return joined.getvalue()
+
+def node_text(node, engine=ENGINE_DEFAULT):
+    """
+    取得節點內全部的文字，包含子節點
+    """
+    if engine == 'lxml':
+        return join_text(__XPATH_TEXT(node))
+    return node.text
+
+def node_own_text(node, engine=ENGINE_DEFAULT):
+    """
+    取得節點本身的文字，丟棄子節點
+    """
+    if engine == 'lxml':
+        return join_text(__XPATH_OWN_TEXT(node))
+    # 只讀取直屬的字串，不複製節點，註解等特殊字串與 node.text 一樣略過
+    return ''.join(
+        child for child in node.children
+        if isinstance(child, NavigableString)
+        and (not isinstance(child, PreformattedString) or isinstance(child, CData))
+    )
+
+def stream_parse(chunks, conf, engine=ENGINE_DEFAULT):
+    """
+    部分分解模式，分段餵資料給 lxml，設定的標題、日期、記者、內文節點都結束後就不再讀取
+
+    chunks 是 str 或 bytes (UTF-8) 片段，engine 為 bs4 時同一批片段也同時餵給 bs4 的 lxml builder，
+    BeautifulSoup 物件隨著讀取進度建立，不需要暫存讀過的部分再整份分解一次
+    """
+    parser = None
+    soup_parser = None
+    root = None
+    finished = set()
+    for chunk in chunks:
+        if parser is None:
+            # 只需要 html 節點的事件取得樹根，其他節點不產生事件以節省時間
+            encoding = None if isinstance(chunk, str) else 'utf-8'
+            parser = lxml.etree.HTMLPullParser(events=('start',), tag='html', encoding=encoding)
+            if engine != 'lxml':
+                soup = BeautifulSoup('', 'lxml')
+                soup.builder.initialize_soup(soup)
+                soup_parser = soup.builder.parser_for(encoding)
+        parser.feed(chunk)
+        if soup_parser is not None:
+            soup_parser.feed(chunk)
+        for (_, node) in parser.read_events():
+            root = node
+        if root is not None and parse_finished(root, conf, finished):
+            break
+
+    if parser is None:
+        return None if engine == 'lxml' else BeautifulSoup('', 'lxml')
+    tree = parser.close()
+    if engine == 'lxml':
+        return tree
+
+    # 與 BeautifulSoup() 分解結束時相同，關閉還沒結束的節點
+    soup_parser.close()
+    soup.endData()
+    while soup.currentTag.name != soup.ROOT_TAG_NAME:
+        soup.popTag()
+    soup.builder.soup = None
+    return soup
+
+def parse_finished(root, conf, finished=None):
+    """
+    檢查部分分解的樹是否已經包含需要的節點
+
+    標題、日期、記者節點必須已經結束，內文節點則是最後一個內文節點的上層節點必須已經結束，
+    之後才不會再出現同一層的內文節點，記者設定為多組 selector 時任何一組找到結束的節點就算完成
+    finished 記錄已經完成的設定，節點結束後不會再變動，下次檢查時略過不再查詢
+    """
+    if finished is None:
+        finished = set()
+    for key in ['title_node', 'date_node', 'author_node']:
+        if key in finished:
+            continue
+        selectors = conf.get(key, '')
+        if isinstance(selectors, str):
+            selectors = [selectors] if selectors != '' else []
+        if selectors:
+            for nsel in selectors:
+                found = compile_selector(nsel)(root)
+                if found and node_closed(found[0]):
+                    break
+            else:
+                return False
+        finished.add(key)
+
+    found = compile_selector(conf['article_node'])(root)
+    return len(found) > 0 and node_closed(found[-1].getparent())
+
+def node_closed(node):
+    """
+    檢查部分分解的樹中，節點是否已經結束
+
+    節點或上層節點後面已經出現文字或其他節點，就表示節點已經結束
+    """
+    while node is not None:
+        if node.tail is not None or node.getnext() is not None:
+            return True
+        node = node.getparent()
+    return False
+
+def scan_author(article):
+    """
+    從新聞內文找出記者姓名
+    """
+    return scan_authors([article])[0]
+
+def scan_authors(articles):
+    """
+    從多篇新聞內文找出記者姓名，回傳與 articles 順序相同的 list，找不到或內文為 None 時是 None
+
+    依照 AUTHOR_PATTERNS 的順序逐一比對，每個規則只比對還沒找到姓名的內文
+    """
+    authors = [None] * len(articles)
+    pending = [idx for (idx, article) in enumerate(articles) if article is not None]
+
+    for (pobj, gidx) in AUTHOR_PATTERNS:
+        unmatched = []
+        for idx in pending:
+            match = pobj.search(articles[idx])
+            if match is not None and match.group(1) not in AUTHOR_EXCLUDE:
+                authors[idx] = match.group(gidx)
+            else:
+                unmatched.append(idx)
+        pending = unmatched
+        if not pending:
+            break
+
+    return authors
@@ -2,7 +2,7 @@
 集保中心資料蒐集模組
 """
 
-import os
+import io
 import re
 import sqlite3
 
@@ -18,20 +18,16 @@ def import_dist(csv_date='latest'):
     """
     logger = common.get_logger('finance')
     csv_dir = common.get_cache_dir('tdcc')
+    date_cache = DateCache('tdcc', 'dist', 'csv')
 
     if csv_date == 'latest':
-        max_date = ''
-        for filename in os.listdir(csv_dir):
-            match = re.match(r'dist-(\d{8}).csv.xz', filename)
-            if match is not None:
-                if max_date < match.group(1):
-                    max_date = match.group(1)
-        csv_date = max_date
-
-    csv_file = '{}/dist-{}.csv.xz'.format(csv_dir, csv_date)
+        # 包含 packed store 裡的日期
+        date_list = date_cache.dates()
+        csv_date = date_list[-1] if date_list else ''
+
     iso_date = re.sub(r'(\d{4})(\d{2})(\d{2})', r'\1-\2-\3', csv_date)
-    if not os.path.isfile(csv_file):
-        logger.error('沒有 TDCC %s 的股權分散表檔案: %s', iso_date, csv_file)
+    if not date_cache.has(csv_date):
+        logger.error('沒有 TDCC %s 的股權分散表檔案: %s', iso_date, csv_dir)
         return
 
     db_conn = get_connection()
@@ -43,8 +39,9 @@ def import_dist(csv_date='latest'):
         'numof_stocks',
         'percentof_stocks'
     ]
-    # Pandas 會自動偵測 extension 解壓縮, 不需要自幹
-    dfrm = pandas.read_csv(csv_file, skiprows=1, header=None, names=col_names)
+    # 透過快取模組讀取，不論壓縮方式或是否存放在 packed store
+    dataset = date_cache.load(csv_date)
+    dfrm = pandas.read_csv(io.StringIO(dataset), skiprows=1, header=None, names=col_names)
     # print(df.head(3))
     # print(df.tail(3))
     sql_template = '''
@@ -91,17 +88,8 @@ def rebuild_dist():
     db_conn.execute('VACUUM') # cannot VACUUM from within a transaction
     db_conn.close()
 
-    # 確認可以重建的日期
-    csv_dir = common.get_cache_dir('tdcc')
-    date_list = []
-    for filename in os.listdir(csv_dir):
-        match = re.match(r'dist-(\d{8}).csv.xz', filename)
-        if match is not None:
-            date_list.append(match.group(1))
-
-    # 依日期順序重建資料
-    date_list.sort()
-    for csv_date in date_list:
+    # 依日期順序重建資料，包含 packed store 裡的日期
+    for csv_date in DateCache('tdcc', 'dist', 'csv').dates():
         import_dist(csv_date)
 
 def backup_dist(refresh=False):
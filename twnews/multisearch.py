@@ -0,0 +1,121 @@
+"""
+多媒體搜尋模組
+"""
+
+import time
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+
+import twnews.common
+from twnews.search import NewsSearch, NewsSearchException, SEARCH_CHANNELS
+
+class MultiSearch:
+    """
+    多媒體搜尋器，同時在多個媒體搜尋同一個關鍵字，總耗時約等於最慢的媒體
+    """
+
+    def __init__(self, channels=None, limit=25, beg_date=None, end_date=None, proxy_first=False,
+                 cache=False):
+        """
+        配置多媒體搜尋器，channels 預設為所有支援搜尋的媒體
+        """
+
+        # pylint: disable=too-many-arguments
+
+        if channels is None:
+            channels = SEARCH_CHANNELS
+        if not channels:
+            raise NewsSearchException('沒有指定搜尋的媒體')
+        self.searches = {}
+        for channel in channels:
+            self.searches[channel] = NewsSearch(
+                channel,
+                limit=limit,
+                beg_date=beg_date,
+                end_date=end_date,
+                proxy_first=proxy_first,
+                cache=cache
+            )
+        self.result = {
+            'elapsed': 0,
+            'errors': {}
+        }
+
+    def by_keyword(self, keyword, title_only=False, window=1):
+        """
+        關鍵字搜尋，搜尋失敗的媒體記錄在 errors()，不影響其他媒體
+        """
+
+        begin_time = time.time()
+        errors = {}
+        logger = twnews.common.get_logger()
+        with ThreadPoolExecutor(len(self.searches)) as executor:
+            futures = {
+                channel: executor.submit(nsearch.by_keyword, keyword, title_only, window)
+                for (channel, nsearch) in self.searches.items()
+            }
+            for (channel, future) in futures.items():
+                try:
+                    future.result()
+                except Exception as ex: # pylint: disable=broad-except
+                    # 任何一個媒體失敗都不能中斷其他媒體的搜尋
+                    logger.error('頻道 %s 搜尋失敗: %s', channel, ex, exc_info=True)
+                    errors[channel] = ex
+
+        self.result = {
+            'elapsed': time.time() - begin_time,
+            'errors': errors
+        }
+        return self
+
+    def iter_merged(self):
+        """
+        依照日期由新到舊合併各媒體的查詢結果
+
+        各媒體的查詢結果已經由新到舊排列，逐筆合併不需要重新排序
+        """
+        return heapq.merge(
+            *[nsearch.result['items'] for nsearch in self.searches.values()],
+            key=lambda item: item.date,
+            reverse=True
+        )
+
+    def to_dict_list(self):
+        """
+        回傳合併後的新聞查詢結果
+        """
+        return [
+            {
+                'channel': item.channel,
+                'title': item.title,
+                'link': item.link,
+                'date': item.date
+            } for item in self.iter_merged()
+        ]
+
+    def counts(self):
+        """
+        各媒體的查詢結果筆數
+        """
+        return {
+            channel: len(nsearch.result['items'])
+            for (channel, nsearch) in self.searches.items()
+        }
+
+    def latency(self):
+        """
+        各媒體的搜尋耗費時間
+        """
+        return {channel: nsearch.elapsed() for (channel, nsearch) in self.searches.items()}
+
+    def elapsed(self):
+        """
+        耗費時間
+        """
+        return self.result['elapsed']
+
+    def errors(self):
+        """
+        搜尋失敗的媒體與例外
+        """
+        return self.result['errors']
@@ -3,52 +3,180 @@
 """
 
 import re
+import json
 import time
+import asyncio
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, Future
 from string import Template
 from datetime import datetime
 
-from bs4 import BeautifulSoup
-from bs4.element import Tag
+import lxml.etree
 
 import twnews.common
-from twnews.soup import NewsSoup
+import twnews.cache
+from twnews.article import NewsArticle
+from twnews.dateparse import get_date_parser
+from twnews.extract import compile_selector, node_text
+from twnews.soup import NewsSoup, url_normalize
+from twnews.batch import soup_batch
 
-def visit_dict(dict_node, path):
+# 去重複時忽略的追蹤參數，utm_ 開頭的參數也會忽略
+TRACKING_PARAMS = frozenset(['fbclid', 'gclid', 'yclid', 'igshid'])
+
+# 去重複時逐筆記錄的重複項目上限，超過的部分只記錄筆數
+DUPLICATED_WARNING_LIMIT = 10
+
+# 支援搜尋的媒體
+SEARCH_CHANNELS = ['appledaily', 'cna', 'ettoday', 'ltn', 'setn', 'udn']
+
+# 可以在搜尋網址設定日期範圍的媒體
+DATE_FILTER_CHANNELS = ['appledaily', 'ltn']
+
+# 沒有最大頁數資訊的媒體，日期範圍翻頁時假設的頁數上限
+FLIP_PAGE_LIMIT = 512
+
+# 查詢結果無法解析時的重新下載次數，與每次重新下載前增加的等待秒數
+PAGE_RETRY = 2
+PAGE_RETRY_DELAY = 1
+
+# 各頻道的搜尋結果擷取器，與 API 查詢結果的 key tuple
+__EXTRACTORS = {}
+__JSON_KEYS = {}
+
+def compile_path(path):
     """
-    用 CSS Selector 的形式拜訪 dict
+    CSS Selector 形式的路徑轉換成 key tuple
+    """
+    if path == '':
+        return ()
+    return tuple(path.split(' > '))
+
+def visit_keys(dict_node, keys):
+    """
+    依照 key tuple 拜訪 dict
     """
-    keys = []
-    if path != '':
-        keys = path.split(' > ')
     visited = dict_node
     for key in keys:
         visited = visited[key]
     return visited
 
+def visit_dict(dict_node, path):
+    """
+    用 CSS Selector 的形式拜訪 dict
+    """
+    return visit_keys(dict_node, compile_path(path))
+
+def link_key(link, channel=''):
+    """
+    連結去重複用的鍵值
+
+    忽略 http/https、www/m 主機名稱、結尾斜線、追蹤參數、參數順序與 fragment，
+    自由時報的電腦版網址先轉成行動版
+    """
+    parts = urllib.parse.urlsplit(url_normalize(link, channel))
+    host = parts.netloc.lower()
+    for prefix in ['www.', 'm.']:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    query = sorted(
+        (name, value)
+        for (name, value) in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if not name.startswith('utm_') and name not in TRACKING_PARAMS
+    )
+    return '{}{}?{}'.format(host, parts.path.rstrip('/'), urllib.parse.urlencode(query))
+
 def filter_duplicated(results):
     """
-    以連結為鍵值去重複化
+    以正規化後的連結為鍵值去重複化，保留第一次出現的項目
     """
     filtered = []
+    found = {}
+    duplicated = 0
     logger = twnews.common.get_logger()
 
     for (cidx, result) in enumerate(results):
-        duplicated = False
-        pidx = -1
-        for pidx in range(cidx):
-            previous = results[pidx]
-            if result['link'] == previous['link']:
-                duplicated = True
-                break
-
-        if not duplicated:
+        key = link_key(result.link, result.channel)
+        pidx = found.get(key)
+        if pidx is None:
+            found[key] = cidx
             filtered.append(result)
         else:
-            logger.warning('查詢結果的 %d, %d 筆重複，新聞網址 %s', cidx, pidx, result['link'])
+            duplicated += 1
+            if duplicated <= DUPLICATED_WARNING_LIMIT:
+                logger.warning('查詢結果的 %d, %d 筆重複，新聞網址 %s', cidx, pidx, result.link)
+
+    if duplicated > DUPLICATED_WARNING_LIMIT:
+        logger.warning(
+            '查詢結果另外還有 %d 筆重複，不再逐筆記錄',
+            duplicated - DUPLICATED_WARNING_LIMIT
+        )
 
     return filtered
 
+class ResultExtractor:
+    """
+    HTML 搜尋結果頁面的擷取器，預先編譯各節點的 XPath
+
+    每則搜尋結果只在自己的子樹裡找標題、連結、日期節點，一次取出 (標題, 連結, 日期字串)
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, conf):
+        self.result_xpath = compile_selector(conf['result_node'])
+        self.title_xpath = compile_selector(conf['title_node'], relative=True)
+        self.link_xpath = compile_selector(conf['link_node'], relative=True)
+        self.date_xpath = compile_selector(conf['date_node'], relative=True)
+        self.date_pattern = None
+        if 'date_pattern' in conf:
+            self.date_pattern = re.compile(conf['date_pattern'])
+
+    def extract(self, root):
+        """
+        取出頁面上全部的搜尋結果，回傳 (標題, 連結, 日期字串) list
+
+        搜尋結果缺少任何一個節點時產生 IndexError
+        """
+        rows = []
+        for node in self.result_xpath(root):
+            title = node_text(self.title_xpath(node)[0], 'lxml').strip()
+            href = self.link_xpath(node)[0].get('href')
+            date_text = node_text(self.date_xpath(node)[0], 'lxml')
+            if self.date_pattern is not None:
+                # DOM node 除了日期還有其他文字
+                date_text = self.date_pattern.search(date_text).group(0)
+            else:
+                # DOM node 只有日期
+                date_text = date_text.strip()
+            rows.append((title, href, date_text))
+        return rows
+
+def get_result_extractor(channel):
+    """
+    取得頻道的搜尋結果擷取器，如果已經存在就使用現有的
+    """
+    extractor = __EXTRACTORS.get(channel)
+    if extractor is None:
+        extractor = ResultExtractor(twnews.common.get_channel_conf(channel, 'search'))
+        __EXTRACTORS[channel] = extractor
+    return extractor
+
+def get_json_keys(channel):
+    """
+    取得頻道 API 查詢結果各節點的 key tuple，如果已經存在就使用現有的
+    """
+    keys = __JSON_KEYS.get(channel)
+    if keys is None:
+        conf = twnews.common.get_channel_conf(channel, 'search')
+        keys = {
+            name: compile_path(conf[name])
+            for name in ['result_node', 'title_node', 'link_node', 'date_node']
+        }
+        __JSON_KEYS[channel] = keys
+    return keys
+
 class NewsSearchException(Exception):
     """
     新聞搜尋例外
@@ -59,9 +187,13 @@ class NewsSearch:
     新聞搜尋器
     """
 
-    def __init__(self, channel, limit=25, beg_date=None, end_date=None, proxy_first=False):
+    def __init__(self, channel, limit=25, beg_date=None, end_date=None, proxy_first=False,
+                 cache=False):
         """
         配置新聞搜尋器
+
+        cache 為 True 時，查詢結果頁面會存入共用的搜尋快取，下次執行相同的查詢不必重新下載，
+        也可以指定 SearchCache 物件使用其他位置的快取
         """
 
         # pylint: disable=too-many-arguments
@@ -86,7 +218,8 @@ class NewsSearch:
             'end_date': None,
             'channel': channel,
             'limit': limit,
-            'proxy_first': proxy_first
+            'proxy_first': proxy_first,
+            'cache': cache
         }
         try:
             if beg_date is not None:
@@ -108,7 +241,9 @@ class NewsSearch:
                 raise NewsSearchException(msg)
 
         self.conf = twnews.common.get_channel_conf(channel, 'search')
+        self.date_parser = get_date_parser(channel, 'search', self.conf['date_format'])
         self.context = None
+        self.loaded_pages = {}
         self.result = {
             'pages': 0,
             'elapsed': 0,
@@ -119,75 +254,235 @@ class NewsSearch:
             'base': ''
         }
 
-    def by_keyword(self, keyword, title_only=False):
+    def by_keyword(self, keyword, title_only=False, window=1):
         """
         關鍵字搜尋
-        """
 
-        # pylint: disable=fixme
+        window 大於 1 時同時下載多頁，參考 __collect_pages()
+        """
 
-        logger = twnews.common.get_logger()
         page = 1
         results = []
         no_more = False
         begin_time = time.time()
 
-        # 如果蘋果和自由以外的媒體有設定日期範圍，先跳到合適的頁數
-        # -   支援: 東森、聯合
-        # - 不支援: 三立、中央社
-        # TODO: 三立、中央社研擬假設 500 頁的二分翻頁法
-        if self.params['beg_date'] is not None and self.params['channel'] in ['ettoday', 'udn']:
-            # 東森、聯合採取二分翻頁法
+        if self.__need_flip():
             page = self.__flip_to_end_date(keyword)
 
+        if window > 1:
+            page = self.__collect_pages(keyword, title_only, page, results, window)
+        else:
+            while not no_more and len(results) < self.params['limit']:
+                self.__load_page(keyword, page)
+                (no_more, _) = self.__collect_results(keyword, title_only, page, results)
+                page += 1
+
+        self.__set_result(results, page - 1, begin_time)
+        return self
+
+    def iter_keyword(self, keyword, title_only=False, parse=False):
+        """
+        關鍵字搜尋，每下載一頁就產生這一頁的查詢結果 (NewsArticle)
+
+        呼叫端停止取值時不再下載後續頁面，查詢結果不保存，to_dict_list() 為空
+        parse 為 True 時查詢結果直接交給 soup_batch() 下載分解，產生分解後的 NewsArticle，
+        順序依照分解完成的先後
+        """
+        items = self.__iter_results(keyword, title_only)
+        if parse:
+            return self.__iter_articles(items)
+        return items
+
+    async def aby_keyword(self, keyword, title_only=False):
+        """
+        關鍵字搜尋 (非同步)
+        """
+
+        page = 1
+        results = []
+        no_more = False
+        begin_time = time.time()
+
+        if self.__need_flip():
+            # 二分翻頁法還是同步處理，交給 thread pool 避免卡住 event loop
+            loop = asyncio.get_event_loop()
+            page = await loop.run_in_executor(None, self.__flip_to_end_date, keyword)
+
         while not no_more and len(results) < self.params['limit']:
-            self.__load_page(keyword, page)
-
-            # 拆查詢結果
-            result_nodes = self.__result_nodes()
-            result_count = len(result_nodes)
-            logger.info('第 %d 頁: 有 %d 筆搜尋結果', page, result_count)
-            if result_count > 0:
-                for node in result_nodes:
-                    date_inst = self.__parse_date_node(node)
-                    if self.params['beg_date'] is not None and \
-                       self.params['channel'] not in ['appledaily', 'ltn']:
-                        # 過濾開頭超過日期範圍的項目
-                        if date_inst > self.params['end_date']:
-                            continue
-                        # 過濾結尾超過日期範圍的項目
-                        if date_inst < self.params['beg_date']:
-                            no_more = True
-                            break
+            await self.__aload_page(keyword, page)
+            (no_more, _) = self.__collect_results(keyword, title_only, page, results)
+            page += 1
+
+        self.__set_result(results, page - 1, begin_time)
+        return self
+
+    def __iter_results(self, keyword, title_only):
+        """
+        iter_keyword() 的查詢結果 generator，邊產生邊去除重複連結
+        """
+
+        page = 1
+        count = 0
+        no_more = False
+        seen = set()
+        begin_time = time.time()
 
-                    title = self.__parse_title_node(node)
-                    link = self.__parse_link_node(node)
-                    if (not title_only) or (keyword in title):
-                        results.append({
-                            "title": title,
-                            "link": link,
-                            'date': date_inst
-                        })
-                        if len(results) == self.params['limit']:
+        try:
+            if self.__need_flip():
+                page = self.__flip_to_end_date(keyword)
+
+            while not no_more and count < self.params['limit']:
+                self.__load_page(keyword, page)
+                results = []
+                (no_more, _) = self.__collect_results(keyword, title_only, page, results)
+                page += 1
+                for item in results:
+                    key = link_key(item.link, item.channel)
+                    if key not in seen:
+                        seen.add(key)
+                        count += 1
+                        yield item
+                        if count == self.params['limit']:
                             break
-            else:
-                no_more = True
+        finally:
+            self.__set_result([], page - 1, begin_time)
 
-            page += 1
+    def __iter_articles(self, items):
+        """
+        查詢結果交給 soup_batch() 分解，產生分解後的 NewsArticle，分解失敗的項目略過
+        """
+        links = (item.link for item in items)
+        for entry in soup_batch(links, proxy_first=self.params['proxy_first']):
+            if entry['error'] is not None:
+                continue
+            yield NewsArticle(
+                entry['path'],
+                entry['channel'],
+                title=entry['title'],
+                date=entry['date'],
+                author=entry['author'],
+                contents=entry['contents']
+            )
+
+    def __need_flip(self):
+        """
+        如果蘋果和自由以外的媒體有設定日期範圍，先跳到合適的頁數
+        蘋果和自由可以在搜尋網址設定日期範圍，不需要翻頁
+        """
+        return self.params['beg_date'] is not None and \
+            self.params['channel'] not in DATE_FILTER_CHANNELS
+
+    def __collect_pages(self, keyword, title_only, page, results, window):
+        """
+        同時下載多頁查詢結果，依照頁數順序拆解，回傳最後處理的頁數 + 1
+
+        第一頁單獨下載，取得每頁筆數後，依照還需要的頁數同時下載，最多 window 頁，
+        遇到沒有結果或超過日期範圍就不再下載，遇到不足一頁的頁面改回逐頁下載
+
+        只有實際拆解的頁面寫入 loaded_pages，搜尋結束後仍在執行的下載不會影響搜尋器
+        """
+
+        # pylint: disable=too-many-arguments
+
+        limit = self.params['limit']
+        page_size = 0
+        next_page = page
+        pending = {}
+        no_more = False
+        executor = ThreadPoolExecutor(window)
+        try:
+            while not no_more and len(results) < limit:
+                ahead = 1
+                if page_size > 0:
+                    ahead = min(window, -(-(limit - len(results)) // page_size))
+                while next_page - page < ahead:
+                    if (keyword, next_page) in self.loaded_pages:
+                        # 翻頁時已經載入過的頁面
+                        pending[next_page] = Future()
+                        pending[next_page].set_result(self.loaded_pages[(keyword, next_page)])
+                    else:
+                        pending[next_page] = executor.submit(
+                            self.__request_page, keyword, next_page
+                        )
+                    next_page += 1
+
+                self.context = pending.pop(page).result()
+                self.loaded_pages[(keyword, page)] = self.context
+                (no_more, result_count) = self.__collect_results(keyword, title_only, page, results)
+                if page_size == 0:
+                    page_size = result_count
+                elif result_count < page_size:
+                    # 結果不足一頁，可能已經是最後一頁
+                    window = 1
+                page += 1
+        finally:
+            for future in pending.values():
+                future.cancel()
+            executor.shutdown(wait=False)
+
+        return page
+
+    def __collect_results(self, keyword, title_only, page, results):
+        """
+        拆目前頁面的查詢結果，加入 results，回傳 (是否已經沒有更多結果, 這一頁的結果筆數)
+        """
+        logger = twnews.common.get_logger()
+        no_more = False
+
+        result_nodes = self.__result_nodes()
+        result_count = len(result_nodes)
+        logger.info('第 %d 頁: 有 %d 筆搜尋結果', page, result_count)
+        if result_count > 0:
+            for node in result_nodes:
+                date_inst = self.__parse_date_node(node)
+                if self.params['beg_date'] is not None and \
+                   self.params['channel'] not in DATE_FILTER_CHANNELS:
+                    # 過濾開頭超過日期範圍的項目
+                    if date_inst > self.params['end_date']:
+                        continue
+                    # 過濾結尾超過日期範圍的項目
+                    if date_inst < self.params['beg_date']:
+                        no_more = True
+                        break
+
+                title = self.__parse_title_node(node)
+                link = self.__parse_link_node(node)
+                if (not title_only) or (keyword in title):
+                    results.append(NewsArticle(
+                        link,
+                        self.params['channel'],
+                        title=title,
+                        date=date_inst
+                    ))
+                    if len(results) == self.params['limit']:
+                        break
+        else:
+            no_more = True
 
+        return (no_more, result_count)
+
+    def __set_result(self, results, pages, begin_time):
+        """
+        儲存查詢結果
+        """
         self.result = {
-            'pages': page - 1,
+            'pages': pages,
             'elapsed': time.time() - begin_time,
             'items': filter_duplicated(results)
         }
-
-        return self
+        self.loaded_pages.clear()
 
     def to_dict_list(self):
         """
         回傳新聞查詢結果
         """
-        return self.result['items']
+        return [
+            {
+                'title': item.title,
+                'link': item.link,
+                'date': item.date
+            } for item in self.result['items']
+        ]
 
     def to_soup_list(self):
         """
@@ -195,10 +490,28 @@ class NewsSearch:
         """
         soup_list = []
         for result in self.result['items']:
-            nsoup = NewsSoup(result['link'], proxy_first=self.params['proxy_first'])
+            nsoup = NewsSoup(result.link, proxy_first=self.params['proxy_first'])
             soup_list.append(nsoup)
         return soup_list
 
+    def to_article_list(self, parse=True):
+        """
+        回傳新聞查詢結果分解後的 NewsArticle，每則新聞分解完就釋放分解樹
+        無法載入的新聞不列入
+
+        parse 為 False 時不分解新聞，直接回傳只有標題、連結、日期的查詢結果
+        """
+        if not parse:
+            return list(self.result['items'])
+
+        article_list = []
+        for result in self.result['items']:
+            nsoup = NewsSoup(result.link, proxy_first=self.params['proxy_first'])
+            article = nsoup.to_article()
+            if article is not None:
+                article_list.append(article)
+        return article_list
+
     def elapsed(self):
         """
         耗費時間
@@ -214,90 +527,71 @@ class NewsSearch:
     def __flip_to_end_date(self, keyword):
         """
         回傳篩選時間範圍的開始頁數
-        """
 
-        page_range = {
-            'lower': 1,
-            'upper': 1000
-        }
+        搜尋結果由新到舊排列，找出第一個最後一則不晚於結束日期的頁面，之前的頁面都可以跳過
+        - 有最大頁數的媒體: 在 1 ~ 最大頁數之間二分搜尋
+        - 沒有最大頁數的媒體: 先試探 2, 4, 8 ... 頁找出上限 (最多 FLIP_PAGE_LIMIT 頁)，再二分搜尋
+        """
 
-        date_range = {
-            'lower': datetime.fromtimestamp(0),
-            'upper': datetime.today()
-        }
+        if not self.__after_end_date(keyword, 1):
+            return 1
 
-        # 取得最大頁數
-        self.__load_page(keyword, 1)
-        node = self.context.select(self.conf['last_page'])[0]
-        if 'page_pattern' in self.conf:
-            match = re.search(self.conf['page_pattern'], node.text)
-            if match:
-                page_range['upper'] = int(match.group(1))
+        # lower 和之前的頁面都晚於結束日期，upper 不是
+        lower = 1
+        upper = self.__last_page() + 1
+        logger = twnews.common.get_logger()
+        if upper == 1:
+            upper = 2
+            while upper < FLIP_PAGE_LIMIT and self.__after_end_date(keyword, upper):
+                lower = upper
+                upper = min(upper * 2, FLIP_PAGE_LIMIT)
+            logger.info('試探頁數: %d ~ %d', lower, upper)
+
+        while upper - lower > 1:
+            mid_page = (lower + upper) // 2
+            if self.__after_end_date(keyword, mid_page):
+                lower = mid_page
             else:
-                page_range['upper'] = -1
-        else:
-            try:
-                page_range['upper'] = int(node.text)
-            except ValueError:
-                page_range['upper'] = -1
+                upper = mid_page
+            logger.info('page: %d ~ %d, mid=%d', lower, upper, mid_page)
 
-        if page_range['upper'] == -1:
-            return 1
+        return upper
 
-        # 取第一則搜尋結果的日期
-        date_range['upper'] = self.__parse_date_node(self.__result_nodes()[0])
-        if date_range['upper'] < self.params['end_date']:
-            return 1
+    def __after_end_date(self, keyword, page):
+        """
+        載入頁面，檢查整頁的搜尋結果是否都晚於結束日期，沒有搜尋結果時視為否
+        """
+        self.__load_page(keyword, page)
+        result_nodes = self.__result_nodes()
+        if len(result_nodes) == 0:
+            return False
+        return self.__parse_date_node(result_nodes[-1]) > self.params['end_date']
 
-        # 取最後一頁最後一則搜尋結果的日期
-        self.__load_page(keyword, page_range['upper'])
-        date_range['lower'] = self.__parse_date_node(self.__result_nodes()[-1])
-        if date_range['lower'] > self.params['end_date']:
-            return -1
+    def __last_page(self):
+        """
+        從目前頁面取最大頁數，無法取得時回傳 0
+        """
+        if 'last_page' not in self.conf or self.context is None or isinstance(self.context, dict):
+            return 0
 
-        # 起始狀態
-        page_dist = page_range['upper'] - page_range['lower']
-        prev_dist = page_range['upper'] - page_range['lower'] + 1
-        logger = twnews.common.get_logger()
-        logger.info(
-            'page: %d ~ %d, date: %s ~ %s',
-            page_range['lower'],
-            page_range['upper'],
-            date_range['upper'],
-            date_range['lower']
-        )
+        nodes = compile_selector(self.conf['last_page'])(self.context)
+        if len(nodes) == 0:
+            return 0
 
-        # 取中間頁數，檢查是否能縮小範圍
-        # 不能縮小範圍時，表示 page_range 的新聞都有 self.params['end_date'] 這一天的
-        while page_dist < prev_dist:
-            mid_page = (page_range['lower'] + page_range['upper']) // 2
-            self.__load_page(keyword, mid_page)
-            middle_udt = self.__parse_date_node(self.__result_nodes()[0])
-            middle_ldt = self.__parse_date_node(self.__result_nodes()[-1])
-
-            if middle_udt > self.params['end_date']:
-                page_range['lower'] = mid_page
-                date_range['upper'] = middle_udt
-
-            if middle_ldt < self.params['end_date']:
-                page_range['upper'] = mid_page
-                date_range['lower'] = middle_ldt
-
-            prev_dist = page_dist
-            page_dist = page_range['upper'] - page_range['lower']
-            logger.info(
-                'page: %d ~ %d, date: %s ~ %s, mid=%d',
-                page_range['lower'],
-                page_range['upper'],
-                date_range['upper'],
-                date_range['lower'],
-                mid_page
-            )
+        text = node_text(nodes[0], 'lxml')
+        if 'page_pattern' in self.conf:
+            match = re.search(self.conf['page_pattern'], text)
+            return int(match.group(1)) if match else 0
 
-        return page_range['lower']
+        try:
+            return int(text)
+        except ValueError:
+            return 0
 
-    def __load_page(self, keyword, page):
-        # pylint: disable=fixme
+    def __page_url(self, keyword, page):
+        """
+        組查詢網址
+        """
 
         # 組查詢條件
         replacement = {
@@ -307,50 +601,237 @@ class NewsSearch:
         url = Template(self.conf['url']).substitute(replacement)
 
         # 再加上日期範圍
-        if self.params['beg_date'] is not None and self.params['channel'] in ['appledaily', 'ltn']:
+        if self.params['beg_date'] is not None and self.params['channel'] in DATE_FILTER_CHANNELS:
             url += self.params['beg_date'].strftime(self.conf['begin_date_format'])
             url += self.params['end_date'].strftime(self.conf['end_date_format'])
 
-        # 查詢
-        session = twnews.common.get_session(proxy_first=self.params['proxy_first'])
+        return url
+
+    def __load_page(self, keyword, page):
+        """
+        下載查詢結果頁面，作為目前頁面
+        """
+        self.context = self.__fetch_page(keyword, page)
+
+    def __fetch_page(self, keyword, page):
+        """
+        下載查詢結果頁面，回傳 lxml 的樹根或 dict，沒有結果時回傳 None
+
+        同一次搜尋已經載入過的頁面不重新下載，例如翻頁時檢查過的頁面
+        """
+
+        key = (keyword, page)
+        if key not in self.loaded_pages:
+            self.loaded_pages[key] = self.__request_page(keyword, page)
+        return self.loaded_pages[key]
+
+    def __request_page(self, keyword, page):
+        """
+        從快取或網站取得查詢結果頁面，回傳 lxml 的樹根或 dict，沒有結果時回傳 None
+
+        不讀寫 loaded_pages 也不修改目前頁面，可以在 thread pool 執行
+        """
+
+        context = None
+        page_data = self.__cached_page(keyword, page)
+        if page_data is not None:
+            context = self.__parse_page(page_data)
+        else:
+            url = self.__page_url(keyword, page)
+            session = twnews.common.get_session(proxy_first=self.params['proxy_first'])
+            for retry in range(PAGE_RETRY + 1):
+                if retry > 0:
+                    time.sleep(PAGE_RETRY_DELAY * retry)
+                page_data = self.__download_page(session, url)
+                if page_data is None:
+                    break
+                try:
+                    context = self.__parse_page(page_data)
+                except ValueError as ex:
+                    self.__parse_failed(url, retry, ex)
+                    continue
+                self.__cache_page(keyword, page, page_data)
+                break
+
+        return context
+
+    async def __aload_page(self, keyword, page):
+        """
+        __load_page() 的非同步版本
+        """
+
+        key = (keyword, page)
+        if key in self.loaded_pages:
+            self.context = self.loaded_pages[key]
+            return
+
+        context = None
+        loop = asyncio.get_event_loop()
+        page_data = self.__cached_page(keyword, page)
+        if page_data is not None:
+            context = await loop.run_in_executor(None, self.__parse_page, page_data)
+        else:
+            url = self.__page_url(keyword, page)
+            session = twnews.common.get_async_session(self.params['proxy_first'])
+            for retry in range(PAGE_RETRY + 1):
+                if retry > 0:
+                    await asyncio.sleep(PAGE_RETRY_DELAY * retry)
+                page_data = await self.__adownload_page(session, url)
+                if page_data is None:
+                    break
+                try:
+                    context = await loop.run_in_executor(None, self.__parse_page, page_data)
+                except ValueError as ex:
+                    self.__parse_failed(url, retry, ex)
+                    continue
+                self.__cache_page(keyword, page, page_data)
+                break
+
+        self.context = context
+        self.loaded_pages[key] = context
+
+    @staticmethod
+    def __download_page(session, url):
+        """
+        下載頁面，回傳 (Content-Type, 回應內容)，沒有更多查詢結果時回傳 None
+
+        JSON 保留原始 bytes 直接交給 json.loads()，省去轉成字串的步驟
+        """
         logger = twnews.common.get_logger()
         logger.info('新聞搜尋 %s', url)
         resp = session.get(url, allow_redirects=False)
         if resp.status_code == 200:
             logger.debug('回應 200 OK')
             ctype = resp.headers['Content-Type']
-            if 'text/html' in ctype:
-                self.context = BeautifulSoup(resp.text, 'lxml')
             if 'application/json' in ctype:
-                # TODO: 這裡有時會發生 decode error
-                self.context = resp.json()
-        elif resp.status_code == 404:
+                return (ctype, resp.content)
+            return (ctype, resp.text)
+        if resp.status_code == 404:
             logger.debug('回應 404 Not Found，視為沒有更多查詢結果')
-            self.context = None
         else:
             logger.warning('回應碼: %s', resp.status_code)
-            self.context = None
+        return None
+
+    @staticmethod
+    async def __adownload_page(session, url):
+        """
+        __download_page() 的非同步版本
+        """
+        logger = twnews.common.get_logger()
+        logger.info('新聞搜尋 %s', url)
+        async with session.get(url, allow_redirects=False) as resp:
+            if resp.status == 200:
+                logger.debug('回應 200 OK')
+                ctype = resp.headers['Content-Type']
+                if 'application/json' in ctype:
+                    return (ctype, await resp.read())
+                return (ctype, await resp.text())
+            if resp.status == 404:
+                logger.debug('回應 404 Not Found，視為沒有更多查詢結果')
+            else:
+                logger.warning('回應碼: %s', resp.status)
+        return None
+
+    @staticmethod
+    def __parse_failed(url, retry, ex):
+        """
+        頁面內容無法解析，通常是 API 回應不完整，還可以重試時記錄警告，否則產生例外
+
+        不把無法解析的頁面當作沒有更多結果，避免呼叫端拿到被截斷的查詢結果
+        """
+        if retry < PAGE_RETRY:
+            logger = twnews.common.get_logger()
+            logger.warning('查詢結果無法解析，重新下載 %s (%s)', url, ex)
+            return
+        msg = '查詢結果重新下載 {} 次仍然無法解析: {}'.format(PAGE_RETRY, url)
+        raise NewsSearchException(msg) from ex
+
+    def __cached_page(self, keyword, page):
+        """
+        從快取取得 (Content-Type, 回應內容)，沒有使用快取或沒有記錄時回傳 None
+        """
+        page_cache = self.__page_cache()
+        if page_cache is None:
+            return None
+        page_data = page_cache.get(self.__cache_key(keyword, page))
+        if page_data is not None:
+            logger = twnews.common.get_logger()
+            logger.info('新聞搜尋 %s 第 %d 頁 (快取)', keyword, page)
+        return page_data
+
+    def __cache_page(self, keyword, page, page_data):
+        """
+        回應內容存入快取
+
+        可以在網址設定日期範圍的媒體，結束日期在今天之前的結果不會再變動，永久保存
+        其他媒體的頁面會隨著新的新聞往後移動，只保存一段時間
+        """
+        page_cache = self.__page_cache()
+        if page_cache is not None:
+            immutable = self.params['end_date'] is not None and \
+                self.params['channel'] in DATE_FILTER_CHANNELS and \
+                self.params['end_date'].date() < datetime.today().date()
+            page_cache.put(
+                self.__cache_key(keyword, page),
+                *page_data,
+                immutable=immutable
+            )
+
+    def __page_cache(self):
+        """
+        取得搜尋快取，沒有使用快取時回傳 None
+        """
+        if self.params['cache'] is True:
+            return twnews.cache.get_search_cache()
+        return self.params['cache'] or None
+
+    def __cache_key(self, keyword, page):
+        """
+        快取鍵值 (頻道, 關鍵字, 開始日期, 結束日期, 頁數)
+        """
+        dates = ['', '']
+        if self.params['beg_date'] is not None:
+            dates = [self.params[name].strftime('%Y-%m-%d') for name in ['beg_date', 'end_date']]
+        return (self.params['channel'], keyword, dates[0], dates[1], page)
+
+    @staticmethod
+    def __parse_page(page_data):
+        """
+        (Content-Type, 回應內容) 轉換成 lxml 的樹根或 dict
+
+        HTML 只用 lxml 建樹不建立 BeautifulSoup 物件，之後以 ResultExtractor 擷取
+        """
+        if page_data is None:
+            return None
+
+        (ctype, body) = page_data
+        if 'text/html' in ctype:
+            parser = lxml.etree.HTMLParser(encoding='utf-8')
+            return lxml.etree.HTML(body.encode('utf-8'), parser)
+        if 'application/json' in ctype:
+            # 回應不完整時產生 ValueError，由呼叫端重新下載
+            return json.loads(body)
+        return None
 
     def __result_nodes(self):
         """
-        取查詢結果的 soup 或 dict
+        取查詢結果，HTML 頁面是 (標題, 連結, 日期字串) tuple，API 是 dict
         """
-        if self.context is not None:
-            if isinstance(self.context, BeautifulSoup):
-                return self.context.select(self.conf['result_node'])
-            return visit_dict(self.context, self.conf['result_node'])
-        return []
+        if self.context is None:
+            return []
+        if isinstance(self.context, dict):
+            return visit_keys(self.context, get_json_keys(self.params['channel'])['result_node'])
+        return get_result_extractor(self.params['channel']).extract(self.context)
 
     def __parse_title_node(self, result_node):
         """
         單筆查詢結果範圍內取標題文字
         """
 
-        if isinstance(result_node, Tag):
-            title_node = result_node.select(self.conf['title_node'])[0]
-            title = title_node.text.strip()
+        if isinstance(result_node, tuple):
+            title = result_node[0]
         else:
-            title = visit_dict(result_node, self.conf['title_node'])
+            title = visit_keys(result_node, get_json_keys(self.params['channel'])['title_node'])
         return title
 
     def __parse_date_node(self, result_node):
@@ -358,31 +839,24 @@ class NewsSearch:
         單筆查詢結果範圍內取報導日期
         """
 
-        if isinstance(result_node, Tag):
-            date_node = result_node.select(self.conf['date_node'])[0]
-            if 'date_pattern' in self.conf:
-                # DOM node 除了日期還有其他文字
-                match = re.search(self.conf['date_pattern'], date_node.text)
-                date_text = match.group(0)
-            else:
-                # DOM node 只有日期
-                date_text = date_node.text.strip()
+        if isinstance(result_node, tuple):
+            # ResultExtractor 已經整理過日期字串
+            date_text = result_node[2]
         else:
             # API 的日期都很乾淨
-            date_text = visit_dict(result_node, self.conf['date_node'])
+            date_text = visit_keys(result_node, get_json_keys(self.params['channel'])['date_node'])
 
-        date_inst = datetime.strptime(date_text, self.conf['date_format'])
+        date_inst = self.date_parser.parse(date_text)
         return date_inst
 
     def __parse_link_node(self, result_node):
         """
         單筆查詢結果範圍內取新聞連結
         """
-        if isinstance(result_node, Tag):
-            link_node = result_node.select(self.conf['link_node'])[0]
-            href = link_node['href']
+        if isinstance(result_node, tuple):
+            href = result_node[1]
         else:
-            href = visit_dict(result_node, self.conf['link_node'])
+            href = visit_keys(result_node, get_json_keys(self.params['channel'])['link_node'])
 
         # 完整網址
         if href.startswith('https://'):
@@ -398,9 +872,9 @@ class NewsSearch:
         # 相對路徑
         # 自由的 <head> 有設定 base_url
         if self.url_prefix['base'] == '':
-            nodes = self.context.select('head > base')
+            nodes = compile_selector('head > base')(self.context)
             if len(nodes) == 1:
-                self.url_prefix['base'] = nodes[0]['href']
+                self.url_prefix['base'] = nodes[0].get('href')
             else:
                 base_end = self.conf['url'].rfind('/')
                 self.url_prefix['base'] = self.conf['url'][0:base_end+1]
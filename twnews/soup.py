@@ -4,36 +4,106 @@
 
 import io
 import re
-import copy
-import lzma
+import asyncio
+import functools
 import hashlib
-import os
-import os.path
-from datetime import datetime
 
 import requests
 import requests.exceptions
+import lxml.etree
 from bs4 import BeautifulSoup
 
 import twnews.common
+import twnews.cache
+from twnews.article import NewsArticle
+from twnews.dateparse import get_date_parser
+from twnews.extract import ENGINE_LIST, ENGINE_DEFAULT, STREAM_CHUNK_SIZE, \
+    select_many, node_text, node_own_text, stream_parse, scan_author
+
+# 下載網頁時最多跟隨的轉址次數
+REDIRECT_HOPS = 10
+
+# lxml 引擎分段餵資料給 parser 的大小
+FEED_CHUNK_SIZE = 64 * 1024
+
+def get_cache_id(uri):
+    """
+    取得快取代號
+    """
+    return hashlib.md5(uri.encode('ascii')).hexdigest()
 
 def get_cache_filepath(channel, uri):
     """
-    取得快取檔案路徑
+    取得快取檔案路徑，副檔名依照頻道的壓縮方式決定
     """
-    cache_id = hashlib.md5(uri.encode('ascii')).hexdigest()
-    path = '{}/{}.html.xz'.format(twnews.common.get_cache_dir(channel), cache_id)
+    cache_id = get_cache_id(uri)
+    path = '{}/{}.html{}'.format(
+        twnews.common.get_cache_dir(channel),
+        cache_id,
+        twnews.cache.get_codec_extension(channel)
+    )
     return path
 
+def find_cache_filepath(channel, cache_id):
+    """
+    尋找存在的快取檔案路徑，不限壓縮方式，不存在時回傳 None
+    """
+    base_path = '{}/{}.html'.format(twnews.common.get_cache_dir(channel), cache_id)
+    return twnews.cache.find_cache_file(base_path, channel)
+
+def url_from_index(url, channel):
+    """
+    從新聞快取索引取得下載過的最終網址，沒有記錄或快取檔不存在時回傳 None
+    """
+    entry = twnews.cache.get_article_index().get(url)
+    if entry is None:
+        return None
+    (_, final_url, cache_id) = entry
+    if find_cache_filepath(channel, cache_id) is None:
+        return None
+    return final_url
+
+def record_article(url, channel, final_url):
+    """
+    記錄轉址與新聞快取索引，原始網址與正規化網址都對應到最終網址的快取
+    """
+    redirects = twnews.cache.get_redirect_cache()
+    if redirects.get(url) != final_url:
+        redirects.put(url, final_url)
+
+    index = twnews.cache.get_article_index()
+    entry = index.get(url)
+    if entry is None or entry[1] != final_url:
+        urls = [url, url_normalize(url, channel), final_url]
+        cache_id = get_cache_id(final_url[final_url.find('/', 10):])
+        index.put(urls, channel, final_url, cache_id)
+
+def url_resolve_location(url, dest):
+    """
+    把轉址的 Location 換成完整網址
+    """
+    if dest.startswith('//'):
+        return 'https:' + dest
+    if dest.startswith('/'):
+        return url[0:url.find('/', 10)] + dest
+    return dest
+
 def url_follow_redirection(url, proxy_first):
     """
-    取得轉址後的 URL
+    取得轉址後的 URL，優先使用轉址快取
     """
     logger = twnews.common.get_logger()
+    redirects = twnews.cache.get_redirect_cache()
+    cached_url = redirects.get(url)
+    if cached_url is not None:
+        logger.debug('使用轉址快取: %s -> %s', url, cached_url)
+        return cached_url
+
     session = twnews.common.get_session(proxy_first)
     old_url = url
     new_url = ''
     done = False
+    failed = False
 
     while not done:
         try:
@@ -41,12 +111,7 @@ def url_follow_redirection(url, proxy_first):
             status = resp.status_code
             if status in (301, 302):
                 dest = resp.headers['Location']
-                if dest.startswith('//'):
-                    new_url = 'https:' + dest
-                elif dest.startswith('/'):
-                    new_url = old_url[0:old_url.find('/', 10)] + dest
-                else:
-                    new_url = dest
+                new_url = url_resolve_location(old_url, dest)
                 logger.debug('===== 轉址細節 =====')
                 logger.debug('HTTP Status: %d', status)
                 logger.debug('Location: %s', dest)
@@ -61,9 +126,62 @@ def url_follow_redirection(url, proxy_first):
                 logger.error('HTTP Status: %d，', status)
                 logger.error('URL: %s，', old_url)
                 done = True
+                failed = True
         except requests.exceptions.ConnectionError as ex:
             logger.error('檢查轉址過程連線失敗: %s', ex)
             done = True
+            failed = True
+
+    if not failed:
+        redirects.put(url, old_url)
+
+    return old_url
+
+async def aurl_follow_redirection(url, proxy_first):
+    """
+    取得轉址後的 URL，優先使用轉址快取 (非同步)
+    """
+    # pylint: disable=import-outside-toplevel, too-many-locals
+    import aiohttp
+
+    logger = twnews.common.get_logger()
+    loop = asyncio.get_event_loop()
+    redirects = twnews.cache.get_redirect_cache()
+    # 轉址快取是 SQLite，交給 thread pool 避免卡住 event loop
+    cached_url = await loop.run_in_executor(None, redirects.get, url)
+    if cached_url is not None:
+        logger.debug('使用轉址快取: %s -> %s', url, cached_url)
+        return cached_url
+
+    session = twnews.common.get_async_session(proxy_first)
+    old_url = url
+    done = False
+    failed = False
+
+    while not done:
+        try:
+            async with session.head(old_url, allow_redirects=False) as resp:
+                status = resp.status
+                if status in (301, 302):
+                    dest = resp.headers['Location']
+                    new_url = url_resolve_location(old_url, dest)
+                    logger.debug('轉址 (HTTP %d): %s -> %s', status, old_url, new_url)
+                    old_url = new_url
+                elif status == 200:
+                    done = True
+                else:
+                    logger.error('檢查轉址過程發生錯誤')
+                    logger.error('HTTP Status: %d，', status)
+                    logger.error('URL: %s，', old_url)
+                    done = True
+                    failed = True
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as ex:
+            logger.error('檢查轉址過程連線失敗: %r', ex)
+            done = True
+            failed = True
+
+    if not failed:
+        await loop.run_in_executor(None, redirects.put, url, old_url)
 
     return old_url
 
@@ -104,100 +222,253 @@ def url_force_ltn_mobile(url):
 
     return new_url
 
-def soup_from_website(url, channel, refresh, proxy_first):
+def url_normalize(url, channel):
+    """
+    網址正規化，強制使用 https 與自由時報行動版
+    """
+    new_url = url_force_https(url)
+    if channel == 'ltn':
+        new_url = url_force_ltn_mobile(new_url)
+    return new_url
+
+def detect_layout(channel, path):
+    """
+    偵測路徑對應的排版
     """
-    網址轉換成 BeautifulSoup 4 物件
+    layout = 'mobile'
+    layout_list = twnews.common.get_channel_conf(channel, 'layout_list')
+    for item in layout_list:
+        if path.startswith(item['prefix']):
+            layout = item['layout']
+    return layout
+
+def html_from_website(url, channel, refresh, proxy_first):
+    """
+    網址轉換成 HTML 原始碼，下載後寫入快取
+
+    GET 的同時處理轉址並寫入轉址快取，不需要事先用 HEAD 檢查
+    回傳 (原始碼, 位元組數, 最終網址)
     """
     logger = twnews.common.get_logger()
     session = twnews.common.get_session(proxy_first)
 
-    # 嘗試使用快取
-    soup = None
+    html = None
     rawlen = 0
-    uri = url[url.find('/', 10):]
-    path = get_cache_filepath(channel, uri)
-    if os.path.isfile(path) and not refresh:
-        logger.debug('發現快取, URL: %s', url)
-        logger.debug('載入快取, PATH: %s', path)
-        (soup, rawlen) = soup_from_file(path)
-
-    # 下載網頁
-    if soup is None:
-        logger.debug('GET URL: %s', url)
+    # 先正規化再下載，只有 301/302 需要再跑一趟
+    final_url = url_normalize(url, channel)
+    hops = 0
+
+    while html is None:
+        # 嘗試使用快取
+        uri = final_url[final_url.find('/', 10):]
+        path = find_cache_filepath(channel, get_cache_id(uri))
+        if path is not None and not refresh:
+            logger.debug('發現快取, URL: %s', final_url)
+            logger.debug('載入快取, PATH: %s', path)
+            (html, rawlen) = html_from_file(path)
+            break
+
+        # 下載網頁
+        logger.debug('GET URL: %s', final_url)
         try:
-            resp = session.get(url, allow_redirects=False)
-            if resp.status_code == 200:
-                logger.debug('回應 200 OK')
-                if resp.headers['content-type'].find('charset=') == -1:
-                    # #80: 蘋果日報主頻道 Content-Type: text/html
-                    #      因為沒有指定編碼造成 requests 誤判, 使用小伎倆迴避
-                    content = resp.content.decode('utf-8')
-                else:
-                    content = resp.text
-                soup = BeautifulSoup(content, 'lxml')
-                rawlen = len(resp.text.encode('utf-8'))
-                with lzma.open(path, 'wt') as cache_file:
-                    logger.debug('寫入快取: %s', path)
-                    cache_file.write(content)
-            else:
-                logger.warning('回應碼: %d', resp.status_code)
+            resp = session.get(final_url, allow_redirects=False)
         except requests.exceptions.ConnectionError as ex:
             logger.error('連線失敗: %s', ex)
+            break
+
+        dest = None
+        if resp.status_code in (301, 302):
+            dest = url_normalize(url_resolve_location(final_url, resp.headers['Location']), channel)
+        elif resp.status_code == 200:
+            logger.debug('回應 200 OK')
+            if resp.headers['content-type'].find('charset=') == -1:
+                # #80: 蘋果日報主頻道 Content-Type: text/html
+                #      因為沒有指定編碼造成 requests 誤判, 使用小伎倆迴避
+                html = resp.content.decode('utf-8')
+            else:
+                html = resp.text
+            rawlen = len(resp.text.encode('utf-8'))
+            html_to_file(get_cache_filepath(channel, uri), html)
+        else:
+            logger.warning('回應碼: %d', resp.status_code)
+            break
+
+        if dest is not None:
+            hops += 1
+            if hops > REDIRECT_HOPS:
+                logger.error('轉址次數過多: %s', url)
+                break
+            logger.debug('轉址 (HTTP %d): %s -> %s', resp.status_code, final_url, dest)
+            final_url = dest
 
-    return (soup, rawlen)
+    if html is not None:
+        record_article(url, channel, final_url)
+
+    return (html, rawlen, final_url)
 
-def soup_from_file(file_path):
+async def ahtml_from_website(url, channel, refresh, proxy_first):
     """
-    本地檔案轉換成 BeautifulSoup 4 物件
+    網址轉換成 HTML 原始碼，下載後寫入快取 (非同步)
+
+    GET 的同時處理轉址並寫入轉址快取，回傳 (原始碼, 位元組數, 最終網址)
     """
+    # pylint: disable=import-outside-toplevel, too-many-branches, too-many-locals, too-many-statements
+    import aiohttp
+
+    logger = twnews.common.get_logger()
+    session = twnews.common.get_async_session(proxy_first)
+    loop = asyncio.get_event_loop()
+
     html = None
+    rawlen = 0
+    # 先正規化再下載，只有 301/302 需要再跑一趟
+    final_url = url_normalize(url, channel)
+    hops = 0
+
+    while html is None:
+        # 嘗試使用快取，檔案系統與解壓縮都交給 thread pool 避免卡住 event loop
+        uri = final_url[final_url.find('/', 10):]
+        path = await loop.run_in_executor(None, find_cache_filepath, channel, get_cache_id(uri))
+        if path is not None and not refresh:
+            logger.debug('發現快取, URL: %s', final_url)
+            logger.debug('載入快取, PATH: %s', path)
+            (html, rawlen) = await loop.run_in_executor(None, html_from_file, path)
+            break
+
+        # 下載網頁
+        logger.debug('GET URL: %s', final_url)
+        try:
+            async with session.get(final_url, allow_redirects=False) as resp:
+                status = resp.status
+                dest = None
+                if status in (301, 302):
+                    location = url_resolve_location(final_url, resp.headers['Location'])
+                    dest = url_normalize(location, channel)
+                elif status == 200:
+                    logger.debug('回應 200 OK')
+                    if resp.headers['content-type'].find('charset=') == -1:
+                        # #80: 同步版本的蘋果日報編碼問題
+                        html = (await resp.read()).decode('utf-8')
+                    else:
+                        html = await resp.text()
+                    rawlen = len(html.encode('utf-8'))
+                    await loop.run_in_executor(None, html_to_cache, channel, uri, html)
+                else:
+                    logger.warning('回應碼: %d', status)
+                    break
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as ex:
+            logger.error('連線失敗: %r', ex)
+            break
+
+        if dest is not None:
+            hops += 1
+            if hops > REDIRECT_HOPS:
+                logger.error('轉址次數過多: %s', url)
+                break
+            logger.debug('轉址 (HTTP %d): %s -> %s', status, final_url, dest)
+            final_url = dest
+
+    if html is not None:
+        await loop.run_in_executor(None, record_article, url, channel, final_url)
+
+    return (html, rawlen, final_url)
+
+def soup_from_website(url, channel, refresh, proxy_first, engine=ENGINE_DEFAULT, conf=None):
+    """
+    網址轉換成 BeautifulSoup 4 物件，engine 為 lxml 時轉換成 lxml 的樹
+
+    有提供 conf 時使用部分分解模式，參考 stream_parse()
+    """
+
+    # pylint: disable=too-many-arguments
+
+    # 有快取就走 soup_from_file() 直接分解 bytes
+    if not refresh:
+        uri = url[url.find('/', 10):]
+        path = find_cache_filepath(channel, get_cache_id(uri))
+        if path is not None:
+            twnews.common.get_logger().debug('發現快取, URL: %s', url)
+            return soup_from_file(path, engine, conf)
+
     soup = None
+    (html, rawlen, _) = html_from_website(url, channel, refresh, proxy_first)
+    if html is not None:
+        soup = soup_from_html(html, engine, conf)
+    return (soup, rawlen)
+
+def html_to_cache(channel, uri, html):
+    """
+    HTML 原始碼寫入頻道的快取，路徑依照頻道的壓縮方式決定
+    """
+    html_to_file(get_cache_filepath(channel, uri), html)
+
+def html_from_file(file_path):
+    """
+    本地檔案轉換成 HTML 原始碼
+    """
+    html = None
     clen = 0
 
-    if file_path.endswith('.xz'):
-        with lzma.open(file_path, 'rt') as cache_file:
-            html = cache_file.read()
-    else:
-        with open(file_path, 'rt') as cache_file:
-            html = cache_file.read()
+    # 檔案不存在時會嘗試從同目錄的 packed store 讀取
+    html = twnews.cache.read_cache_text(file_path)
 
     if html is not None:
-        soup = BeautifulSoup(html, 'lxml')
         clen = len(html.encode('utf-8'))
 
-    return (soup, clen)
+    return (html, clen)
 
-def scan_author(article):
+def html_to_file(file_path, html):
     """
-    從新聞內文找出記者姓名
+    HTML 原始碼寫入快取檔案，頻道設定為 packed 時寫入 packed store
     """
+    logger = twnews.common.get_logger()
+    logger.debug('寫入快取: %s', file_path)
+    twnews.cache.write_cache_text(file_path, html)
 
-    patterns = [
-        (r'(記者|中心)(\w{2,5})[/／╱](.+報導|特稿)', 2),
-        (r'文[/／╱]記者(\w{2,5})', 1),
-        (r'[\(（](\w{2,5})[/／╱].+報導[\)）]', 1),
-        (r'記者(\w{2,3}).{2}[縣市]?\d{1,2}日電', 1),
-        (r'(記者|遊戲角落 )(\w{2,5})$', 2),
-        (r'\s(\w{2,5})[/／╱].+報導$', 1),
-        (r'（譯者：(\w{2,5})/.+）', 1),
-        (r'【(\w{2,5})╱.+報導】', 1)
-    ]
+def soup_from_file(file_path, engine=ENGINE_DEFAULT, conf=None):
+    """
+    本地檔案轉換成 BeautifulSoup 4 物件，engine 為 lxml 時轉換成 lxml 的樹
 
-    exclude_list = [
-        '國際中心',
-        '地方中心',
-        '社會中心',
-        '攝影'
-    ]
+    直接把 bytes 交給 lxml 解碼，不需要先轉成 str，沒壓縮的快取會用 mmap 讀取
+    lxml 引擎分段餵資料，不會複製整份 mmap 內容
+    有提供 conf 時使用部分分解模式，邊解壓縮邊分解，剩下的內容只計算長度
+    """
+    if conf is not None:
+        with twnews.cache.open_cache_stream(file_path) as stream:
+            chunks = iter(functools.partial(stream.read, STREAM_CHUNK_SIZE), b'')
+            soup = stream_parse(chunks, conf, engine)
+            clen = stream.tell() + sum(len(chunk) for chunk in chunks)
+        return (soup, clen)
+
+    with twnews.cache.map_cache_file(file_path) as data:
+        clen = len(data)
+        if engine == 'lxml':
+            parser = lxml.etree.HTMLParser(encoding='utf-8')
+            for offset in range(0, clen, FEED_CHUNK_SIZE):
+                parser.feed(bytes(data[offset:offset + FEED_CHUNK_SIZE]))
+            soup = parser.close()
+        else:
+            soup = BeautifulSoup(bytes(data), 'lxml', from_encoding='utf-8')
+    return (soup, clen)
 
-    for (patt, gidx) in patterns:
-        pobj = re.compile(patt)
-        match = pobj.search(article)
-        if match is not None:
-            if match.group(1) not in exclude_list:
-                return match.group(gidx)
+def soup_from_html(html, engine=ENGINE_DEFAULT, conf=None):
+    """
+    HTML 原始碼轉換成 BeautifulSoup 4 物件，engine 為 lxml 時轉換成 lxml 的樹
 
-    return None
+    有提供 conf 時使用部分分解模式，參考 stream_parse()
+    """
+    if conf is not None:
+        chunks = (
+            html[offset:offset + STREAM_CHUNK_SIZE]
+            for offset in range(0, len(html), STREAM_CHUNK_SIZE)
+        )
+        return stream_parse(chunks, conf, engine)
+
+    if engine == 'lxml':
+        parser = lxml.etree.HTMLParser()
+        parser.feed(html)
+        return parser.close()
+    return BeautifulSoup(html, 'lxml')
 
 class NewsSoup:
     """
@@ -206,27 +477,35 @@ class NewsSoup:
 
     # pylint: disable=too-many-instance-attributes
 
-    def __init__(self, path, refresh=False, proxy_first=False):
+    def __init__(self, path, refresh=False, proxy_first=False, engine=ENGINE_DEFAULT,
+                 partial=False):
         """
         建立新聞分解器
+
+        engine 為 lxml 時不建立 BeautifulSoup 物件，soup 屬性會是 lxml 的樹
+        partial 為 True 時使用部分分解模式，需要的節點都讀到後就不再分解後面的頁尾、留言等內容
         """
 
+        # pylint: disable=too-many-arguments
+
+        if engine not in ENGINE_LIST:
+            raise ValueError('不支援的分解引擎: {}'.format(engine))
+
         self.path = path
+        self.engine = engine
+        self.partial = partial
         self.refresh = refresh
         self.proxy_first = proxy_first
         self.loaded = False
+        self.fetched = False
+        self.html = None
         self.soup = None
+        self.found = None
+        self.released = False
         self.rawlen = 0
         self.logger = twnews.common.get_logger()
         self.channel = twnews.common.detect_channel(path)
-        self.cache = {
-            'title': None,
-            'date_raw': None,
-            'date': None,
-            'author': None,
-            'contents': None,
-            'tags': None
-        }
+        self.article = NewsArticle(path, self.channel)
 
         if self.channel == '':
             self.logger.error('不支援的新聞台，請檢查設定檔')
@@ -234,35 +513,89 @@ class NewsSoup:
 
         # URL 正規化
         if self.path.startswith('http'):
-            self.path = url_follow_redirection(self.path, self.proxy_first)
-            self.path = url_force_https(self.path)
-            if self.channel == 'ltn':
-                self.path = url_force_ltn_mobile(self.path)
+            self.path = url_normalize(self._follow_redirection(self.path), self.channel)
 
         # Layout 偵測
-        layout = 'mobile'
-        layout_list = twnews.common.get_channel_conf(self.channel, 'layout_list')
-        for item in layout_list:
-            if self.path.startswith(item['prefix']):
-                layout = item['layout']
+        self.layout = detect_layout(self.channel, self.path)
+        self.conf = twnews.common.get_channel_conf(self.channel, self.layout)
+
+    def _follow_redirection(self, url):
+        """
+        URL 正規化的轉址步驟，非同步版本會改寫這個方法
+
+        新聞快取索引或轉址快取有記錄就不連線，都沒有記錄就直接下載網頁，GET 的同時處理轉址
+        """
+        if not self.refresh:
+            indexed_url = url_from_index(url, self.channel)
+            if indexed_url is not None:
+                self.logger.debug('使用新聞快取索引: %s -> %s', url, indexed_url)
+                return indexed_url
+
+        cached_url = twnews.cache.get_redirect_cache().get(url)
+        if cached_url is not None:
+            self.logger.debug('使用轉址快取: %s -> %s', url, cached_url)
+            return cached_url
+
+        (self.html, self.rawlen, final_url) = html_from_website(
+            url,
+            self.channel,
+            self.refresh,
+            self.proxy_first
+        )
+        self.fetched = True
+        return final_url
+
+    def __getstate__(self):
+        """
+        序列化時略過 logger 與 BeautifulSoup 物件，讓分解器可以傳給 process pool
+        """
+        state = self.__dict__.copy()
+        state['logger'] = None
+        state['soup'] = None
+        state['found'] = None
+        state['loaded'] = False
+        return state
+
+    def __setstate__(self, state):
+        """
+        反序列化後重新取得 logger
+        """
+        self.__dict__.update(state)
+        self.logger = twnews.common.get_logger()
 
-        self.conf = twnews.common.get_channel_conf(self.channel, layout)
+    def _partial_conf(self):
+        """
+        部分分解模式使用的頻道設定，沒有使用部分分解模式時回傳 None
+        """
+        return self.conf if self.partial else None
 
     def __get_soup(self):
         if not self.loaded:
             self.loaded = True
             try:
-                if self.path.startswith('http'):
+                if self.html is not None:
+                    self.logger.debug('分解已下載的新聞')
+                    self.soup = soup_from_html(self.html, self.engine, self._partial_conf())
+                    self.html = None
+                elif self.fetched:
+                    self.logger.debug('已經下載失敗，不再重試')
+                elif self.path.startswith('http'):
                     self.logger.debug('從網路載入新聞')
                     (self.soup, self.rawlen) = soup_from_website(
                         self.path,
                         self.channel,
                         self.refresh,
-                        self.proxy_first
+                        self.proxy_first,
+                        self.engine,
+                        self._partial_conf()
                     )
                 else:
                     self.logger.debug('從檔案載入新聞')
-                    (self.soup, self.rawlen) = soup_from_file(self.path)
+                    (self.soup, self.rawlen) = soup_from_file(
+                        self.path,
+                        self.engine,
+                        self._partial_conf()
+                    )
             except requests.ConnectionError as ex:
                 self.logger.error('因連線問題，無法載入新聞: %s', ex)
                 self.logger.error(self.path)
@@ -278,6 +611,64 @@ class NewsSoup:
 
         return self.soup
 
+    def __select(self, nsel):
+        """
+        取得 selector 找到的節點，第一次呼叫時一次找出全部欄位的節點
+        """
+        if self.found is None:
+            selectors = [
+                self.conf['title_node'],
+                self.conf['date_node'],
+                self.conf['article_node']
+            ]
+            if isinstance(self.conf['author_node'], str):
+                selectors.append(self.conf['author_node'])
+            else:
+                selectors.extend(self.conf['author_node'])
+            selectors = [css for css in selectors if css != '']
+            self.found = select_many(self.soup, selectors, self.engine)
+        return self.found[nsel]
+
+    def extract_all(self, release=False):
+        """
+        一次取得全部欄位，回傳 dict，無法載入新聞時回傳 None
+
+        release 為 True 時取得欄位後釋放分解樹，之後的欄位都從已取得的結果回傳
+        """
+        if self.__get_soup() is None and not self.released:
+            return None
+
+        fields = {
+            'title': self.title(),
+            'date_raw': self.date_raw(),
+            'date': self.date(),
+            'author': self.author(),
+            'contents': self.contents()
+        }
+
+        if release:
+            # BeautifulSoup 的樹有循環參照，先拆開才能馬上回收，不必等 GC
+            # 直接對 BeautifulSoup 物件 decompose() 不會拆開，必須逐一拆開最上層的節點
+            if self.engine == 'bs4' and self.soup is not None:
+                for node in list(self.soup.contents):
+                    node.decompose()
+            self.soup = None
+            self.found = None
+            self.released = True
+
+        return fields
+
+    def to_article(self, release=True):
+        """
+        取得只保存欄位的 NewsArticle，預設會釋放分解樹，無法載入新聞時回傳 None
+        """
+        if self.extract_all(release) is None:
+            return None
+
+        self.article.link = self.path
+        self.article.text_rate = self.effective_text_rate()
+        return self.article
+
     def title(self):
         """
         取得新聞標題
@@ -285,23 +676,20 @@ class NewsSoup:
 
         soup = self.__get_soup()
         if soup is None:
-            return None
+            return self.article.title
 
-        if self.cache['title'] is None:
+        if self.article.title is None:
             nsel = self.conf['title_node']
-            found = soup.select(nsel)
+            found = self.__select(nsel)
             if found:
-                node = copy.copy(found[0])
                 # 避免子元件干擾日期格式
-                for child_node in node.select('*'):
-                    child_node.extract()
-                self.cache['title'] = node.text.strip()
+                self.article.title = node_own_text(found[0], self.engine).strip()
                 if len(found) > 1:
                     self.logger.warning('找到多組標題節點 (新聞台: %s)', self.channel)
             else:
                 self.logger.error('找不到標題節點 (新聞台: %s)', self.channel)
 
-        return self.cache['title']
+        return self.article.title
 
     def date_raw(self):
         """
@@ -310,26 +698,26 @@ class NewsSoup:
 
         soup = self.__get_soup()
         if soup is None:
-            return None
+            return self.article.date_raw
 
-        if self.cache['date_raw'] is None:
+        if self.article.date_raw is None:
             nsel = self.conf['date_node']
-            found = soup.select(nsel)
+            found = self.__select(nsel)
             if found:
-                node = copy.copy(found[0])
                 # 中時: 日期散落在兩個子節點，不可丟棄子節點
                 # 聯合: 日期在這個節點，子節點有其他文字，必須丟棄子節點
                 if 'date_with_children' not in self.conf or not self.conf['date_with_children']:
                     # 丟棄子節點
-                    for child_node in node.select('*'):
-                        child_node.extract()
-                self.cache['date_raw'] = node.text.strip()
+                    date_raw = node_own_text(found[0], self.engine)
+                else:
+                    date_raw = node_text(found[0], self.engine)
+                self.article.date_raw = date_raw.strip()
                 if len(found) > 1:
                     self.logger.warning('發現多組日期節點 (新聞台: %s)', self.channel)
             else:
                 self.logger.error('找不到日期時間節點 (新聞台: %s)', self.channel)
 
-        return self.cache['date_raw']
+        return self.article.date_raw
 
     def date(self):
         """
@@ -338,25 +726,16 @@ class NewsSoup:
 
         soup = self.__get_soup()
         if soup is None:
-            return None
+            return self.article.date
 
-        if self.cache['date'] is None:
-            formats = self.conf['date_format']
-            if isinstance(formats, str):
-                formats = [formats]
-
-            for dfmt in formats:
-                try:
-                    self.cache['date'] = datetime.strptime(self.date_raw(), dfmt)
-                except TypeError as ex:
-                    errmsg = '日期格式分析失敗 {} (新聞台: {})'.format(ex, self.channel)
-                except ValueError as ex:
-                    errmsg = '日期格式分析失敗 {} (新聞台: {})'.format(ex, self.channel)
-
-            if self.cache['date'] is None:
-                self.logger.error(errmsg)
+        if self.article.date is None:
+            parser = get_date_parser(self.channel, self.layout, self.conf['date_format'])
+            try:
+                self.article.date = parser.parse(self.date_raw())
+            except (TypeError, ValueError) as ex:
+                self.logger.error('日期格式分析失敗 %s (新聞台: %s)', ex, self.channel)
 
-        return self.cache['date']
+        return self.article.date
 
     def author(self):
         """
@@ -367,9 +746,9 @@ class NewsSoup:
 
         soup = self.__get_soup()
         if soup is None:
-            return None
+            return self.article.author
 
-        if self.cache['author'] is None:
+        if self.article.author is None:
             nsel = self.conf['author_node']
             if nsel != '':
                 if isinstance(nsel, str):
@@ -377,16 +756,13 @@ class NewsSoup:
                 else:
                     selectors = nsel
                 for nsel in selectors:
-                    found = soup.select(nsel)
+                    found = self.__select(nsel)
                     if found:
-                        node = copy.copy(found[0])
-                        for child_node in node.select('*'):
-                            child_node.extract()
-                        author_raw = node.text.strip()
+                        author_raw = node_own_text(found[0], self.engine).strip()
                         if author_raw[0] != '記' and len(author_raw) <= 5:
-                            self.cache['author'] = author_raw
+                            self.article.author = author_raw
                         else:
-                            self.cache['author'] = scan_author(author_raw)
+                            self.article.author = scan_author(author_raw)
                         if len(found) > 1:
                             self.logger.warning('找到多組記者姓名 (新聞台: %s)', self.channel)
                         break
@@ -395,13 +771,13 @@ class NewsSoup:
             else:
                 contents = self.contents()
                 if contents is not None:
-                    self.cache['author'] = scan_author(contents)
-                    if self.cache['author'] is None:
+                    self.article.author = scan_author(contents)
+                    if self.article.author is None:
                         self.logger.warning('內文中找不到記者姓名 (新聞台: %s)', self.channel)
                 else:
                     self.logger.error('因為沒有內文所以無法比對記者姓名 (新聞台: %s)', self.channel)
 
-        return self.cache['author']
+        return self.article.author
 
     def contents(self, limit=0):
         """
@@ -409,27 +785,27 @@ class NewsSoup:
         """
 
         soup = self.__get_soup()
-        if soup is None:
+        if soup is None and self.article.contents is None:
             return None
 
-        if self.cache['contents'] is None:
+        if self.article.contents is None:
             nsel = self.conf['article_node']
-            found = soup.select(nsel)
+            found = self.__select(nsel)
             if found:
                 contents = io.StringIO()
                 for node in found:
-                    contents.write(node.text.strip())
-                self.cache['contents'] = contents.getvalue()
+                    contents.write(node_text(node, self.engine).strip())
+                self.article.contents = contents.getvalue()
                 contents.close()
             else:
                 self.logger.error('找不到內文節點 (新聞台: %s)', self.channel)
 
-        if isinstance(self.cache['contents'], str) and limit > 0:
+        if isinstance(self.article.contents, str) and limit > 0:
             # https://github.com/PyCQA/pylint/issues/1498
             # pylint: disable=unsubscriptable-object
-            return self.cache['contents'][0:limit]
+            return self.article.contents[0:limit]
 
-        return self.cache['contents']
+        return self.article.contents
 
     def effective_text_rate(self):
         """
@@ -437,7 +813,7 @@ class NewsSoup:
         """
 
         soup = self.__get_soup()
-        if soup is None or self.rawlen == 0:
+        if (soup is None and not self.released) or self.rawlen == 0:
             return 0
 
         data = [
@@ -453,3 +829,75 @@ class NewsSoup:
                 useful_len += len(datum.encode('utf-8'))
 
         return useful_len / self.rawlen
+
+class AsyncNewsSoup(NewsSoup):
+    """
+    非同步新聞分解器
+
+    網路存取改用 aiohttp 共用連線池，分解規則與快取跟 NewsSoup 相同
+    使用前必須先 await load()，之後就能用 NewsSoup 的方法取得各欄位
+    """
+
+    def _follow_redirection(self, url):
+        """
+        建立時不查 SQLite 快取，延後到 load() 交給 thread pool 處理
+        """
+        return url
+
+    def _cached_redirection(self, url):
+        """
+        只查新聞快取索引與轉址快取，查不到就回傳原網址，由 ahtml_from_website() 處理轉址
+        """
+        if not self.refresh:
+            indexed_url = url_from_index(url, self.channel)
+            if indexed_url is not None:
+                return indexed_url
+
+        cached_url = twnews.cache.get_redirect_cache().get(url)
+        if cached_url is not None:
+            return cached_url
+        return url
+
+    async def load(self):
+        """
+        非同步載入新聞
+        """
+        if self.channel == '' or self.loaded:
+            return self
+
+        loop = asyncio.get_event_loop()
+        html = None
+        try:
+            if self.path.startswith('http'):
+                self.logger.debug('從網路載入新聞 (非同步)')
+                cached_url = await loop.run_in_executor(None, self._cached_redirection, self.path)
+                self.path = url_normalize(cached_url, self.channel)
+                (html, self.rawlen, final_url) = await ahtml_from_website(
+                    self.path,
+                    self.channel,
+                    self.refresh,
+                    self.proxy_first
+                )
+                self.path = url_normalize(final_url, self.channel)
+                self.layout = detect_layout(self.channel, self.path)
+                self.conf = twnews.common.get_channel_conf(self.channel, self.layout)
+            else:
+                self.logger.debug('從檔案載入新聞 (非同步)')
+                (html, self.rawlen) = await loop.run_in_executor(None, html_from_file, self.path)
+        except FileNotFoundError as ex:
+            self.logger.error('檔案不存在，無法載入新聞: %s', ex)
+            self.logger.error(self.path)
+
+        self.loaded = True
+        if html is not None:
+            self.soup = await loop.run_in_executor(
+                None,
+                soup_from_html,
+                html,
+                self.engine,
+                self._partial_conf()
+            )
+        else:
+            self.logger.error('無法轉換 BeautifulSoup，可能是網址或檔案路徑錯誤')
+
+        return self
@@ -0,0 +1,374 @@
+"""
+搜尋共用項目測試
+"""
+
+import io
+import json
+import re
+import tempfile
+import time
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+
+import lxml.etree
+from bs4 import BeautifulSoup
+
+from twnews.cache import SearchCache
+from twnews.article import NewsArticle, write_jsonl, to_columns, to_arrow
+from twnews.search import NewsSearch, NewsSearchException, ResultExtractor, \
+    compile_path, visit_dict, filter_duplicated, link_key, DUPLICATED_WARNING_LIMIT
+from twnews.multisearch import MultiSearch
+
+def _seed_cna_pages(cache, keyword, pages, dates=('', ''), encode=False):
+    """
+    把中央社 API 的查詢結果頁面寫入搜尋快取，從第 1 頁開始
+
+    pages 是每一頁的 [(標題, 網址代號, 日期時間)]，空的 list 表示沒有更多結果，
+    encode 為 True 時以 UTF-8 bytes 寫入，與下載的回應內容相同
+    """
+    for (page, page_items) in enumerate(pages, 1):
+        items = [{
+            'HeadLine': title,
+            'PageUrl': 'https://www.cna.com.tw/news/a/{}'.format(link_id),
+            'CreateTime': date_text
+        } for (title, link_id, date_text) in page_items]
+        body = json.dumps({'result': {'SimpleItems': items}}, ensure_ascii=not encode)
+        if encode:
+            body = body.encode('utf-8')
+        cache.put(('cna', keyword) + tuple(dates) + (page,), 'application/json', body)
+
+class RecordingCache(SearchCache):
+    """
+    記錄讀取頁數的搜尋快取，用來檢查翻頁時下載了哪些頁面
+    """
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.pages = []
+
+    def get(self, key):
+        self.pages.append(key[4])
+        return super().get(key)
+
+class TestCommon(unittest.TestCase):
+    """
+    搜尋共用項目測試
+    """
+
+    def setUp(self):
+        link = 'https://udn.com/news/story/{}'
+        self.items = [
+            NewsArticle(link.format(1), 'udn', title='一', date=datetime(2019, 5, 1)),
+            NewsArticle(link.format(2), 'udn', title='二', date=datetime(2019, 5, 2)),
+            NewsArticle(link.format(1), 'udn', title='一', date=datetime(2019, 5, 1))
+        ]
+
+        # 測試用的搜尋快取放在暫存目錄，不影響 ~/.twnews 的快取
+        self.tmpdir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.page_cache = SearchCache(self.tmpdir.name + '/search.sqlite')
+
+    def tearDown(self):
+        self.page_cache.db_conn.close()
+        self.tmpdir.cleanup()
+
+    def test_01_filter_duplicated(self):
+        """
+        測試查詢結果去重複
+        """
+        filtered = filter_duplicated(self.items)
+        self.assertEqual(['一', '二'], [item.title for item in filtered])
+
+        # 內容相同的 NewsArticle 雜湊值相同，可以放進 set
+        self.assertEqual(hash(self.items[0]), hash(self.items[2]))
+        self.assertEqual(2, len(set(self.items)))
+
+        # 網址正規化後相同的連結視為重複
+        same_links = [
+            ('https://news.ltn.com.tw/news/life/breakingnews/2504351', 'ltn'),
+            ('http://m.ltn.com.tw/news/life/breakingnews/2504351/', 'ltn'),
+            ('https://m.ltn.com.tw/news/life/breakingnews/2504351?utm_source=fb&fbclid=x', 'ltn'),
+            ('https://www.ltn.com.tw/news/life/breakingnews/2504351#comments', 'ltn')
+        ]
+        self.assertEqual(1, len(set(link_key(link, channel) for (link, channel) in same_links)))
+        self.assertNotEqual(
+            link_key('https://www.setn.com/News.aspx?NewsID=1', 'setn'),
+            link_key('https://www.setn.com/News.aspx?NewsID=2', 'setn')
+        )
+
+        # 大量重複時只記錄前幾筆
+        items = [NewsArticle('https://udn.com/news/story/1', 'udn')] * 100
+        with self.assertLogs('news', 'WARNING') as logs:
+            self.assertEqual(1, len(filter_duplicated(items)))
+        self.assertEqual(DUPLICATED_WARNING_LIMIT + 1, len(logs.output))
+
+    def test_02_export(self):
+        """
+        測試查詢結果匯出 JSON lines 與欄位導向格式
+        """
+        jsonl = io.StringIO()
+        self.assertEqual(3, write_jsonl(self.items, jsonl))
+        lines = jsonl.getvalue().splitlines()
+        self.assertEqual(3, len(lines))
+        data = json.loads(lines[1])
+        self.assertEqual('二', data['title'])
+        self.assertEqual('2019-05-02T00:00:00', data['date'])
+        self.assertIsNone(data['contents'])
+
+        columns = to_columns(iter(self.items))
+        self.assertEqual(['一', '二', '一'], columns['title'])
+        self.assertEqual(3, len(columns['link']))
+
+        try:
+            table = to_arrow(self.items)
+            self.assertEqual(3, table.num_rows)
+        except ImportError:
+            pass
+
+    def test_03_search_cache(self):
+        """
+        測試搜尋結果頁面快取，快取有記錄時不需要連線就能搜尋
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pages = SearchCache(tmpdir + '/search.sqlite')
+            key = ('udn', 'test', '', '', 1)
+            self.assertIsNone(pages.get(key))
+            pages.put(key, 'text/html', '<html></html>')
+            self.assertEqual(('text/html', '<html></html>'), pages.get(key))
+
+            # 過期的記錄視為不存在，不會再變動的頁面永久保存
+            pages.ttl = -1
+            pages.put(key, 'text/html', '<html></html>')
+            self.assertIsNone(pages.get(key))
+            key = ('ltn', 'test', '2019-05-01', '2019-05-31', 1)
+            pages.put(key, 'text/html', '<html></html>', immutable=True)
+            pages.trim()
+            self.assertEqual(('text/html', '<html></html>'), pages.get(key))
+            pages.db_conn.close()
+
+        keyword = '離線搜尋測試'
+        pages = [[('新', 2, '2019/05/02 10:00'), ('舊', 1, '2019/05/01 00:00')], []]
+        for dates in [('', ''), ('2019-05-01', '2019-05-01')]:
+            _seed_cna_pages(self.page_cache, keyword, pages, dates)
+
+        nsearch = NewsSearch('cna', cache=self.page_cache).by_keyword(keyword)
+        self.assertEqual(['新', '舊'], [item['title'] for item in nsearch.to_dict_list()])
+        self.assertEqual(2, nsearch.pages())
+
+        nsearch = NewsSearch(
+            'cna',
+            beg_date='2019-05-01',
+            end_date='2019-05-01',
+            cache=self.page_cache
+        )
+        nsearch.by_keyword(keyword)
+        self.assertEqual(['舊'], [item['title'] for item in nsearch.to_dict_list()])
+
+    def test_04_multi_search(self):
+        """
+        測試多媒體搜尋，各媒體的查詢結果依照日期合併
+        """
+        keyword = '離線多媒體搜尋測試'
+        _seed_cna_pages(self.page_cache, keyword, [
+            [('中央社新', 2, '2019/05/03 10:00'), ('中央社舊', 1, '2019/05/01 10:00')],
+            []
+        ])
+        html = '''
+        <div class="news-area"><div class="news-info">
+            <div class="news-word"><a href="News.aspx?NewsID=1">三立</a></div>
+            <div class="lable-date">2019/05/02 10:00</div>
+        </div></div>
+        '''
+        for (page, body) in [(1, html), (2, '<html></html>')]:
+            self.page_cache.put(('setn', keyword, '', '', page), 'text/html', body)
+
+        msearch = MultiSearch(['cna', 'setn'], cache=self.page_cache).by_keyword(keyword)
+        self.assertEqual({}, msearch.errors())
+        self.assertEqual({'cna': 2, 'setn': 1}, msearch.counts())
+        self.assertEqual(['cna', 'setn'], sorted(msearch.latency().keys()))
+        results = msearch.to_dict_list()
+        self.assertEqual(['中央社新', '三立', '中央社舊'], [item['title'] for item in results])
+        self.assertEqual('https://www.setn.com/m/News.aspx?NewsID=1', results[1]['link'])
+
+    def test_05_iter_keyword(self):
+        """
+        測試逐頁產生查詢結果，呼叫端停止取值時不再下載後續頁面
+        """
+        keyword = '離線逐頁搜尋測試'
+        _seed_cna_pages(self.page_cache, keyword, [
+            [('一', '一', '2019/05/04 10:00'), ('二', '二', '2019/05/03 10:00')],
+            [('三', '三', '2019/05/02 10:00'), ('一', '一', '2019/05/04 10:00')],
+            []
+        ])
+
+        nsearch = NewsSearch('cna', cache=self.page_cache)
+        self.assertEqual(['一', '二', '三'], [item.title for item in nsearch.iter_keyword(keyword)])
+        self.assertEqual(3, nsearch.pages())
+
+        results = nsearch.iter_keyword(keyword)
+        self.assertEqual('一', next(results).title)
+        results.close()
+        self.assertEqual(1, nsearch.pages())
+
+    def test_06_result_extractor(self):
+        """
+        測試搜尋結果擷取器，結果與 BeautifulSoup 逐項選取相同
+        """
+        conf = {
+            'result_node': '#result-list > div.archive',
+            'link_node': 'div.box_2 > h2 > a',
+            'title_node': 'div.box_2 > h2 > a',
+            'date_node': 'div.box_2 > p.detail > span.date',
+            'date_pattern': '\\d{4}-\\d{2}-\\d{2}'
+        }
+        html = '''<html><body><div id="result-list">
+        <div class="archive"><div class="box_2">
+            <h2><a href="/news/1.htm"> 酒駕<b>撞車</b> </a></h2>
+            <p class="detail"><span class="date">社會 | 2019-05-02 10:00</span></p>
+        </div></div>
+        <div class="archive"><div class="box_2">
+            <h2><a href="https://www.ettoday.net/news/2.htm">
+                酒駕  被逮
+            </a></h2>
+            <p class="detail"><span class="date">政治 | 2019-05-01 09:00</span></p>
+        </div></div>
+        </div></body></html>'''
+
+        soup = BeautifulSoup(html, 'lxml')
+        expected = []
+        for node in soup.select(conf['result_node']):
+            expected.append((
+                node.select(conf['title_node'])[0].text.strip(),
+                node.select(conf['link_node'])[0]['href'],
+                re.search(conf['date_pattern'], node.select(conf['date_node'])[0].text).group(0)
+            ))
+
+        root = lxml.etree.HTML(html.encode('utf-8'), lxml.etree.HTMLParser(encoding='utf-8'))
+        self.assertEqual(expected, ResultExtractor(conf).extract(root))
+        self.assertEqual('酒駕撞車', expected[0][0])
+
+    def test_07_json_path(self):
+        """
+        測試 API 查詢結果的預先編譯路徑，以及直接解析 bytes 的回應內容
+        """
+        data = {'result': {'SimpleItems': [{'HeadLine': '標題'}]}}
+        self.assertEqual(('result', 'SimpleItems'), compile_path('result > SimpleItems'))
+        self.assertEqual((), compile_path(''))
+        self.assertIs(data, visit_dict(data, ''))
+        self.assertEqual('標題', visit_dict(data, 'result > SimpleItems')[0]['HeadLine'])
+
+        keyword = '離線位元組搜尋測試'
+        pages = [[('位元組', 1, '2019/05/01 10:00')], []]
+        _seed_cna_pages(self.page_cache, keyword, pages, encode=True)
+        nsearch = NewsSearch('cna', cache=self.page_cache).by_keyword(keyword)
+        self.assertEqual(['位元組'], [item['title'] for item in nsearch.to_dict_list()])
+
+    def test_08_window(self):
+        """
+        測試同時下載多頁，結果順序與逐頁下載相同，搜尋結束後不保留頁面
+        """
+        keyword = '離線多頁搜尋測試'
+        _seed_cna_pages(self.page_cache, keyword, [
+            [
+                (
+                    '{}-{}'.format(page, idx),
+                    '{}{}'.format(page, idx),
+                    '2019/05/{:02d} {:02d}:00'.format(10 - page, 10 - idx)
+                ) for idx in range(2)
+            ] for page in range(1, 6)
+        ] + [[]])
+
+        expected = ['{}-{}'.format(page, idx) for page in range(1, 6) for idx in range(2)]
+        for (limit, pages) in [(7, 4), (100, 6)]:
+            nsearch = NewsSearch('cna', limit=limit, cache=self.page_cache)
+            nsearch.by_keyword(keyword)
+            sequential = [item['title'] for item in nsearch.to_dict_list()]
+            self.assertEqual(expected[:limit], sequential)
+            self.assertEqual(pages, nsearch.pages())
+
+            nsearch = NewsSearch('cna', limit=limit, cache=self.page_cache)
+            nsearch.by_keyword(keyword, window=3)
+            self.assertEqual(sequential, [item['title'] for item in nsearch.to_dict_list()])
+            self.assertEqual(pages, nsearch.pages())
+
+            # 搜尋結束後還在執行的下載不會寫入 loaded_pages
+            time.sleep(0.1)
+            self.assertEqual({}, nsearch.loaded_pages)
+
+    def test_09_flip(self):
+        """
+        測試沒有最大頁數的媒體先試探再二分翻頁，檢查下載的頁面與開始頁數
+        """
+        keyword = '離線翻頁測試'
+        newest = datetime(2019, 12, 31)
+        # 第 page 頁的兩則新聞都是 newest 往前 page 天
+        pages = [
+            [
+                (
+                    '{}-{}'.format(page, hour),
+                    '{}{}'.format(page, hour),
+                    (newest - timedelta(days=page)).strftime('%Y/%m/%d {:02d}:00'.format(hour))
+                ) for hour in [12, 6]
+            ] for page in range(1, 531)
+        ]
+
+        cases = [
+            # 開始頁數在試探範圍內
+            (37, [1, 2, 4, 8, 16, 32, 64, 48, 40, 36, 38, 37]),
+            # 開始頁數超過 FLIP_PAGE_LIMIT，翻到上限後逐頁往後找
+            (515, [1, 2, 4, 8, 16, 32, 64, 128, 256, 384, 448, 480, 496, 504, 508, 510, 511])
+        ]
+        page_cache = RecordingCache(self.tmpdir.name + '/flip.sqlite')
+        for (start, probes) in cases:
+            # start 頁以後的新聞不晚於結束日期
+            end_date = (newest - timedelta(days=start - 1)).strftime('%Y-%m-%d')
+            beg_date = (newest - timedelta(days=start + 4)).strftime('%Y-%m-%d')
+            _seed_cna_pages(page_cache, keyword, pages, (beg_date, end_date))
+
+            page_cache.pages = []
+            nsearch = NewsSearch('cna', beg_date=beg_date, end_date=end_date, cache=page_cache)
+            results = nsearch.by_keyword(keyword).to_dict_list()
+            self.assertEqual(probes, page_cache.pages[:len(probes)])
+            self.assertEqual(len(page_cache.pages), len(set(page_cache.pages)))
+            titles = [
+                '{}-{}'.format(page, hour)
+                for page in range(start, start + 5)
+                for hour in [12, 6]
+            ]
+            self.assertEqual(titles, [item['title'] for item in results])
+        page_cache.db_conn.close()
+
+    def test_10_undecodable_page(self):
+        """
+        測試重新下載仍然無法解析的頁面會產生例外，不會當作沒有更多結果
+        """
+        downloads = []
+
+        def download_page(_session, url):
+            downloads.append(url)
+            return ('application/json', b'{"result": {"SimpleItems": [')
+
+        download_page = staticmethod(download_page)
+        with mock.patch('twnews.search.PAGE_RETRY_DELAY', 0), \
+             mock.patch.object(NewsSearch, '_NewsSearch__download_page', download_page):
+            nsearch = NewsSearch('cna', cache=self.page_cache)
+            with self.assertRaises(NewsSearchException):
+                nsearch.by_keyword('離線截斷回應測試')
+        self.assertEqual(3, len(downloads))
+
+    def test_11_multi_search_errors(self):
+        """
+        測試多媒體搜尋不接受空的媒體清單，任何媒體失敗都不影響其他媒體
+        """
+        with self.assertRaises(NewsSearchException):
+            MultiSearch([])
+
+        keyword = '離線多媒體失敗測試'
+        _seed_cna_pages(self.page_cache, keyword, [[('中央社', 1, '2019/05/01 10:00')], []])
+
+        msearch = MultiSearch(['cna', 'setn'], cache=self.page_cache)
+        failure = RuntimeError('三立搜尋失敗')
+        with mock.patch.object(msearch.searches['setn'], 'by_keyword', side_effect=failure):
+            msearch.by_keyword(keyword)
+        self.assertEqual({'setn': failure}, msearch.errors())
+        self.assertEqual(['中央社'], [item['title'] for item in msearch.to_dict_list()])
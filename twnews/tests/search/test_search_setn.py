@@ -3,6 +3,7 @@
 """
 
 import unittest
+from datetime import datetime, timedelta
 from twnews.search import NewsSearch
 
 #@unittest.skip
@@ -32,3 +33,15 @@ class TestSetn(unittest.TestCase):
         for nsoup in nsoups:
             if nsoup.contents() is None:
                 self.fail('內文不可為 None')
+
+    def test_03_date_range(self):
+        """
+        測試三立新聞網日期範圍搜尋，沒有最大頁數時先試探再二分翻頁
+        """
+        today = datetime.today()
+        beg_date = (today - timedelta(days=30)).strftime('%Y-%m-%d')
+        end_date = (today - timedelta(days=20)).strftime('%Y-%m-%d')
+        nsearch = NewsSearch('setn', limit=10, beg_date=beg_date, end_date=end_date)
+        for topic in nsearch.by_keyword(self.keyword).to_dict_list():
+            self.assertGreaterEqual(topic['date'], nsearch.params['beg_date'])
+            self.assertLessEqual(topic['date'], nsearch.params['end_date'])
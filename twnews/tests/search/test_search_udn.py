@@ -32,3 +32,13 @@ class TestUdn(unittest.TestCase):
         for nsoup in nsoups:
             if nsoup.title() is None:
                 self.fail('標題不可為 None')
+
+    def test_03_window(self):
+        """
+        測試聯合新聞網多頁同時下載，結果順序與逐頁下載相同
+        """
+        nsearch = NewsSearch('udn', limit=50)
+        expected = [topic['link'] for topic in nsearch.by_keyword(self.keyword).to_dict_list()]
+        nsearch = NewsSearch('udn', limit=50)
+        results = [topic['link'] for topic in nsearch.by_keyword(self.keyword, window=4).to_dict_list()]
+        self.assertEqual(expected, results)
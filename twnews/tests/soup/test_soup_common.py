@@ -7,15 +7,33 @@
 # pylint: disable=wildcard-import,unused-wildcard-import
 
 import os
+import pickle
+import asyncio
+import shutil
+import tempfile
+import threading
 import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
 import twnews.common
+from twnews.cache import RedirectCache, ArticleIndex, DateCache
+from twnews.dateparse import DateParser
+from twnews.extract import select_nodes, node_text, node_own_text, scan_authors
+import twnews.cache
+import twnews.batch
 from twnews.soup import *
+from twnews.batch import soup_batch
 
 class TestCommon(unittest.TestCase):
     """
     不分頻道分解測試
     """
 
+    # pylint: disable=too-many-public-methods
+
     def setUp(self):
         self.url = 'https://tw.appledaily.com/headline/daily/20181201/38194705/'
         self.dtf = '%Y-%m-%d %H:%M:%S'
@@ -190,6 +208,10 @@ class TestCommon(unittest.TestCase):
             msg = '"{}" 不應分析出記者姓名'.format(text)
             self.assertIsNone(author, msg)
 
+        # 批次分析結果與逐篇分析相同
+        expected = [scan_author(text) for text in good_samples + bad_samples] + [None]
+        self.assertEqual(expected, scan_authors(good_samples + bad_samples + [None]))
+
     def test_05_author_in_node(self):
         """
         測試有記者欄的記者姓名分析 (中時、聯合)
@@ -208,3 +230,496 @@ class TestCommon(unittest.TestCase):
             author = nsoup.author()
             msg = '"{}" 不應分析出記者姓名'.format(url)
             self.assertIsNone(author, msg)
+
+    def test_06_soup_batch(self):
+        """
+        測試批次分解，結果必須與逐一分解相同
+        """
+        pkgdir = twnews.common.get_package_dir()
+        channels = ['appledaily', 'chinatimes', 'cna', 'ettoday', 'ltn', 'setn', 'udn']
+        paths = ['{}/samples/{}.html.xz'.format(pkgdir, channel) for channel in channels]
+
+        results = list(soup_batch(paths, parse_workers=2))
+        self.assertEqual(len(paths), len(results))
+        for result in results:
+            nsoup = NewsSoup(result['source'])
+            self.assertEqual(nsoup.channel, result['channel'])
+            self.assertEqual(nsoup.title(), result['title'])
+            self.assertEqual(nsoup.date(), result['date'])
+            self.assertEqual(nsoup.author(), result['author'])
+            self.assertEqual(nsoup.contents(), result['contents'])
+            self.assertIsNone(result['error'])
+
+        # 不支援的頻道回報錯誤，不影響其他項目
+        with tempfile.TemporaryDirectory() as tmpdir:
+            unknown = tmpdir + '/foo.html'
+            with open(unknown, 'w') as html_file:
+                html_file.write('<html></html>')
+            results = list(soup_batch([unknown] + paths[:2], parse_workers=2))
+        self.assertEqual(3, len(results))
+        failed = [result for result in results if result['error'] is not None]
+        self.assertEqual([unknown], [result['source'] for result in failed])
+        self.assertIsNone(failed[0]['title'])
+
+        # 慢的頻道只占用自己的名額，其他頻道不必等待
+        release = threading.Event()
+        batch_fetch = twnews.batch._batch_fetch # pylint: disable=protected-access
+        def slow_fetch(path, *args):
+            if 'udn' in path:
+                release.wait(5)
+            return batch_fetch(path, *args)
+
+        slow_paths = [paths[-1]] * 4 + [paths[2]]
+        with mock.patch('twnews.batch._batch_fetch', slow_fetch):
+            results = soup_batch(slow_paths, fetch_workers=2, parse_workers=1, channel_limit=1)
+            self.assertEqual('cna', next(results)['channel'])
+            release.set()
+            self.assertEqual(['udn'] * 4, [result['channel'] for result in results])
+
+    def test_07_async_soup(self):
+        """
+        測試非同步分解器，結果必須與同步分解器相同
+        """
+        pkgdir = twnews.common.get_package_dir()
+        path = pkgdir + '/samples/udn.html.xz'
+        nsoup = NewsSoup(path)
+        asoup = asyncio.run(AsyncNewsSoup(path).load())
+        self.assertEqual(nsoup.title(), asoup.title())
+        self.assertEqual(nsoup.date(), asoup.date())
+        self.assertEqual(nsoup.author(), asoup.author())
+        self.assertEqual(nsoup.contents(), asoup.contents())
+        self.assertEqual(nsoup.effective_text_rate(), asoup.effective_text_rate())
+
+    def test_08_redirect_cache(self):
+        """
+        測試轉址快取的有效期限與筆數上限
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            redirects = RedirectCache(tmpdir + '/redirect.sqlite', limit=2)
+            src = 'https://news.ltn.com.tw/news/entertainment/breakingnews/2697368'
+            dest = 'https://ent.ltn.com.tw/m/news/breakingnews/2697368'
+            self.assertIsNone(redirects.get(src))
+            redirects.put(src, dest)
+            self.assertEqual(dest, redirects.get(src))
+
+            # 超過筆數上限時刪除最舊的記錄
+            redirects.put('https://udn.com/a', 'https://udn.com/b')
+            redirects.put('https://udn.com/c', 'https://udn.com/d')
+            redirects.trim()
+            self.assertIsNone(redirects.get(src))
+            self.assertEqual('https://udn.com/d', redirects.get('https://udn.com/c'))
+
+            # 過期的記錄視為不存在
+            redirects.ttl = -1
+            self.assertIsNone(redirects.get('https://udn.com/c'))
+
+    def test_09_article_index(self):
+        """
+        測試新聞快取索引，索引有記錄時不需要連線就能分解
+        """
+        pkgdir = twnews.common.get_package_dir()
+        url = 'https://udn.com/news/story/0/offline-index-test'
+        final_url = 'https://udn.com/news/story/0/offline-index-final'
+        final_uri = final_url[final_url.find('/', 10):]
+        cache_path = get_cache_filepath('udn', final_uri)
+        shutil.copyfile(pkgdir + '/samples/udn.html.xz', cache_path)
+
+        # 測試用的索引放在暫存目錄，不影響 ~/.twnews 的索引
+        with tempfile.TemporaryDirectory() as tmpdir:
+            index = ArticleIndex(tmpdir + '/article.sqlite')
+            index.put([url], 'udn', final_url, get_cache_id(final_uri))
+            try:
+                with mock.patch('twnews.cache.__ARTICLE_INDEX', index):
+                    nsoup = NewsSoup(url)
+                    self.assertIs(index, twnews.cache.get_article_index())
+                self.assertEqual(final_url, nsoup.path)
+                self.assertIn('血濺桃機 他把老婆丟下樓再跳樓', nsoup.title())
+
+                # 非同步版本建立時不查索引，load() 時才在 thread pool 查詢
+                threads = []
+                lookup = twnews.soup.url_from_index
+                def record_lookup(*args):
+                    threads.append(threading.current_thread())
+                    return lookup(*args)
+
+                with mock.patch('twnews.cache.__ARTICLE_INDEX', index), \
+                     mock.patch('twnews.soup.url_from_index', record_lookup):
+                    asoup = AsyncNewsSoup(url)
+                    self.assertEqual([], threads)
+                    asyncio.run(asoup.load())
+                self.assertEqual(1, len(threads))
+                self.assertIsNot(threading.main_thread(), threads[0])
+                self.assertEqual(final_url, asoup.path)
+                self.assertEqual(nsoup.title(), asoup.title())
+            finally:
+                index.db_conn.close()
+                os.unlink(cache_path)
+
+    def test_10_codec(self):
+        """
+        測試快取壓縮方式切換，不同壓縮方式的快取可以混用
+        """
+        dcache = DateCache('codec-test', 'item', 'json')
+        content = {'title': '血濺桃機'}
+        try:
+            dcache.save('20190318', content)
+            xz_path = dcache.find_path('20190318')
+            self.assertTrue(xz_path.endswith('.json.xz'))
+
+            # 換成 gz 之後，仍然可以讀取 xz 快取
+            twnews.cache.set_codec('codec-test', 'gz')
+            self.assertTrue(dcache.has('20190318'))
+            self.assertEqual(content, dcache.load('20190318'))
+
+            # 重新儲存後只留下 gz 快取
+            dcache.save('20190318', content)
+            self.assertTrue(dcache.find_path('20190318').endswith('.json.gz'))
+            self.assertFalse(os.path.isfile(xz_path))
+
+            # 轉換中斷時保留原本的快取檔，不留下不完整的新檔與暫存檔
+            gz_path = dcache.find_path('20190318')
+            with mock.patch('twnews.cache.compress', side_effect=KeyboardInterrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    twnews.cache.recompress_file(gz_path, 'xz')
+            self.assertEqual([os.path.basename(gz_path)], os.listdir(os.path.dirname(gz_path)))
+
+            # 轉換成不壓縮
+            self.assertEqual(1, twnews.cache.recompress('none', 'codec-test', workers=1))
+            self.assertTrue(dcache.find_path('20190318').endswith('.json'))
+            self.assertEqual(content, dcache.load('20190318'))
+        finally:
+            twnews.cache.set_codec('codec-test', twnews.cache.CODEC_DEFAULT)
+            shutil.rmtree(os.path.dirname(dcache.get_path('20190318')))
+
+        # cache.json 的設定有錯時一次列出所有錯誤
+        cache_conf = {
+            'codec': {'default': 'xz', 'udn': 'bz2', 'twse': 'zstd'},
+            'storage': {'default': 'files'}
+        }
+        with self.assertRaisesRegex(ValueError, 'codec.udn=bz2, codec.twse=zstd'):
+            twnews.cache.check_cache_conf(cache_conf, 'cache.json')
+        cache_conf['codec'] = {'default': 'gz', 'udn': 'none'}
+        twnews.cache.check_cache_conf(cache_conf, 'cache.json')
+
+    def test_11_packed_store(self):
+        """
+        測試 packed store 匯入、讀寫、壓實
+        """
+        pkgdir = twnews.common.get_package_dir()
+        cache_dir = twnews.common.get_cache_dir('udn-pack-test')
+        shutil.copyfile(pkgdir + '/samples/udn.html.xz', cache_dir + '/sample.html.xz')
+        expected = NewsSoup(pkgdir + '/samples/udn.html.xz').title()
+
+        try:
+            # 匯入一個項目一個檔案的快取
+            store = twnews.cache.get_packed_store(cache_dir)
+            self.assertEqual(1, store.import_files())
+            self.assertFalse(os.path.isfile(cache_dir + '/sample.html.xz'))
+            self.assertEqual(expected, NewsSoup(cache_dir + '/sample.html').title())
+
+            # packed 儲存方式下寫入快取，舊內容等壓實後清除
+            twnews.cache.set_storage('udn-pack-test', 'packed')
+            twnews.cache.write_cache_text(cache_dir + '/other.html.xz', '<html>1</html>')
+            twnews.cache.write_cache_text(cache_dir + '/other.html.xz', '<html>2</html>')
+            self.assertEqual(2, len(store.db_conn.execute('SELECT * FROM `record`').fetchall()))
+            self.assertEqual(2, store.compact('gz'))
+            self.assertEqual(
+                '<html>2</html>',
+                twnews.cache.read_cache_text(cache_dir + '/other.html')
+            )
+            self.assertEqual(expected, NewsSoup(cache_dir + '/sample.html').title())
+            self.assertEqual([2], store.segments())
+
+            # 日期命名快取同時列出檔案與 packed store 裡的日期
+            dcache = DateCache('udn-pack-test', 'dist', 'csv')
+            dcache.save('20190318', 'packed')
+            twnews.cache.set_storage('udn-pack-test', 'files')
+            dcache.save('20190315', 'files')
+            self.assertEqual(['20190315', '20190318'], dcache.dates())
+            self.assertEqual('packed', dcache.load('20190318'))
+
+            # mmap 建立前壓實必須等待，壓實刪除舊 segment 檔後已對應的內容仍然可讀
+            store.write('plain.html', '<html>3</html>', 'none')
+            compactor = threading.Thread(target=store.compact)
+            map_region = twnews.cache.map_region
+            def compact_during_map(*args):
+                compactor.start()
+                compactor.join(0.2)
+                self.assertTrue(compactor.is_alive())
+                return map_region(*args)
+
+            with mock.patch('twnews.cache.map_region', compact_during_map):
+                with store.map('plain.html') as data:
+                    compactor.join()
+                    self.assertEqual(b'<html>3</html>', bytes(data))
+            self.assertEqual([3], store.segments())
+        finally:
+            twnews.cache.set_storage('udn-pack-test', twnews.cache.STORAGE_DEFAULT)
+            shutil.rmtree(cache_dir)
+
+    def test_12_map_cache_file(self):
+        """
+        測試 mmap 讀取快取，結果必須與解碼成 str 後分解相同
+        """
+        pkgdir = twnews.common.get_package_dir()
+        cache_dir = tempfile.mkdtemp(prefix='udn-')
+        html = twnews.cache.read_cache_text(pkgdir + '/samples/udn.html.xz')
+        raw = html.encode('utf-8')
+        expected = NewsSoup(pkgdir + '/samples/udn.html.xz')
+
+        try:
+            # 沒壓縮的檔案
+            path = cache_dir + '/sample.html'
+            twnews.cache.write_cache_text(path, html)
+            with twnews.cache.map_cache_file(path) as data:
+                self.assertEqual(raw, bytes(data))
+            nsoup = NewsSoup(path)
+            self.assertEqual(expected.title(), nsoup.title())
+            self.assertEqual(expected.contents(), nsoup.contents())
+            self.assertEqual(len(raw), nsoup.rawlen)
+
+            # packed store 裡沒壓縮的項目
+            store = twnews.cache.get_packed_store(cache_dir)
+            store.write('first.html', '<html>1</html>', 'none')
+            store.write('sample.html', html, 'none')
+            with twnews.cache.map_cache_file(cache_dir + '/sample.html.xz') as data:
+                self.assertEqual(raw, bytes(data))
+            with twnews.cache.map_cache_file(cache_dir + '/first.html') as data:
+                self.assertEqual(b'<html>1</html>', bytes(data))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_13_lxml_engine(self):
+        """
+        測試 lxml 分解引擎，結果必須與 bs4 相同
+        """
+        pkgdir = twnews.common.get_package_dir()
+        for channel in ['appledaily', 'chinatimes', 'cna', 'ettoday', 'ltn', 'setn', 'udn']:
+            path = '{}/samples/{}.html.xz'.format(pkgdir, channel)
+            expected = NewsSoup(path)
+            nsoup = NewsSoup(path, engine='lxml')
+            self.assertEqual(expected.title(), nsoup.title())
+            self.assertEqual(expected.date(), nsoup.date())
+            self.assertEqual(expected.author(), nsoup.author())
+            self.assertEqual(expected.contents(), nsoup.contents())
+            self.assertEqual(expected.effective_text_rate(), nsoup.effective_text_rate())
+
+        # 內文節點裡的 script、style 兩種引擎都略過
+        html = twnews.cache.read_cache_text(pkgdir + '/samples/udn.html.xz')
+        offset = html.index('<p>', html.index('id="story_body_content"')) + 3
+        html = html[:offset] + '<script>var ad=1;</script><style>.ad{}</style>' + html[offset:]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = tmpdir + '/udn-script.html'
+            twnews.cache.write_cache_text(path, html)
+            expected = NewsSoup(path)
+            nsoup = NewsSoup(path, engine='lxml')
+            self.assertNotIn('var ad', expected.contents())
+            self.assertEqual(expected.contents(), nsoup.contents())
+            self.assertEqual(expected.effective_text_rate(), nsoup.effective_text_rate())
+
+        nsoup = NewsSoup('/tmp/appledaily-notexisted.html', engine='lxml')
+        self.assertIsNone(nsoup.title())
+        self.assertIsNone(nsoup.contents())
+
+        with self.assertRaises(ValueError):
+            NewsSoup(pkgdir + '/samples/udn.html.xz', engine='html5lib')
+
+    def test_14_partial_parse(self):
+        """
+        測試部分分解模式，結果必須與完整分解相同，需要的節點都讀到後就停止
+        """
+        pkgdir = twnews.common.get_package_dir()
+        for channel in ['appledaily', 'chinatimes', 'cna', 'ettoday', 'ltn', 'setn', 'udn']:
+            path = '{}/samples/{}.html.xz'.format(pkgdir, channel)
+            expected = NewsSoup(path)
+            for engine in ENGINE_LIST:
+                nsoup = NewsSoup(path, engine=engine, partial=True)
+                self.assertEqual(expected.title(), nsoup.title())
+                self.assertEqual(expected.date(), nsoup.date())
+                self.assertEqual(expected.author(), nsoup.author())
+                self.assertEqual(expected.contents(), nsoup.contents())
+                self.assertEqual(expected.rawlen, nsoup.rawlen)
+
+        # 頁尾很長時不會分解到頁尾
+        conf = NewsSoup(pkgdir + '/samples/udn.html.xz').conf
+        html = '<html><body><div id="story_body_content"><h1>標題</h1>' \
+            + '<div id="story_bady_info"><div class="story_bady_info_author">' \
+            + '<span>2019-01-01 00:00</span><a>記者</a></div></div>' \
+            + '<p>內文</p></div>' + '<div class="footer">頁尾</div>' * 10000 + '</body></html>'
+        tree = soup_from_html(html, 'lxml', conf)
+        self.assertEqual('標題', node_text(select_nodes(tree, conf['title_node'], 'lxml')[0], 'lxml'))
+        self.assertLess(len(select_nodes(tree, 'div.footer', 'lxml')), 10000)
+
+        # 記者設定為多組 selector 時，第二組找到結束的節點也能提早停止，bs4 引擎也一樣
+        conf = dict(conf, author_node=['span.reporter', conf['author_node']])
+        for engine in ENGINE_LIST:
+            soup = soup_from_html(html, engine, conf)
+            self.assertLess(len(select_nodes(soup, 'div.footer', engine)), 10000)
+
+    def test_15_node_own_text(self):
+        """
+        測試擷取節點本身的文字，略過子節點與註解，不修改原本的節點
+        """
+        html = '<html><body><p>2019-01-01 <!-- 註解 --><span>記者</span>00:00</p></body></html>'
+        for engine in ENGINE_LIST:
+            node = select_nodes(soup_from_html(html, engine), 'p', engine)[0]
+            self.assertEqual('2019-01-01 00:00', node_own_text(node, engine))
+            self.assertEqual('2019-01-01 記者00:00', node_text(node, engine))
+
+    def test_16_date_parser(self):
+        """
+        測試多格式日期解析，結果必須與 datetime.strptime 相同
+        """
+        parser = DateParser(['%Y-%m-%d %H:%M', '%Y-%m-%d'])
+        self.assertEqual(datetime(2019, 5, 1, 12, 30), parser.parse('2019-05-01 12:30'))
+        self.assertEqual(datetime(2019, 5, 1), parser.parse('2019-05-01'))
+        self.assertEqual(1, parser.last)
+        self.assertEqual(datetime(2019, 5, 2, 8, 0), parser.parse('2019-05-02 08:00'))
+        self.assertEqual(0, parser.last)
+        with self.assertRaises(ValueError):
+            parser.parse('2019-02-30')
+        with self.assertRaises(ValueError):
+            parser.parse('2019-05-01 12:30:00')
+        with self.assertRaises(TypeError):
+            parser.parse(None)
+
+        for (fmt, text) in [
+                ('時間： %Y年%m月%d日 %H:%M', '時間： 2019年5月1日 08:05'),
+                ('%H:%M%Y/%m/%d', '12:302019/05/01'),
+                ('%b. %d %Y', 'May. 01 2019'),
+                ('%Y%m%d', '20190501')
+            ]:
+            self.assertEqual(datetime.strptime(text, fmt), DateParser(fmt).parse(text))
+
+    def test_17_extract_all(self):
+        """
+        測試一次取得全部欄位，結果必須與個別取得相同
+        """
+        pkgdir = twnews.common.get_package_dir()
+        for channel in ['appledaily', 'chinatimes', 'cna', 'ettoday', 'ltn', 'setn', 'udn']:
+            path = '{}/samples/{}.html.xz'.format(pkgdir, channel)
+            for engine in ENGINE_LIST:
+                expected = NewsSoup(path, engine=engine)
+                fields = NewsSoup(path, engine=engine).extract_all()
+                self.assertEqual(expected.title(), fields['title'])
+                self.assertEqual(expected.date_raw(), fields['date_raw'])
+                self.assertEqual(expected.date(), fields['date'])
+                self.assertEqual(expected.author(), fields['author'])
+                self.assertEqual(expected.contents(), fields['contents'])
+
+        self.assertIsNone(NewsSoup('/tmp/appledaily-notexisted.html').extract_all())
+
+    def test_18_release(self):
+        """
+        測試取得欄位後釋放分解樹
+        """
+        pkgdir = twnews.common.get_package_dir()
+        for engine in ENGINE_LIST:
+            expected = NewsSoup(pkgdir + '/samples/udn.html.xz', engine=engine)
+            nsoup = NewsSoup(pkgdir + '/samples/udn.html.xz', engine=engine)
+            article = nsoup.to_article()
+            self.assertIsNone(nsoup.soup)
+            self.assertEqual(expected.title(), article.title)
+            self.assertEqual(expected.date(), article.date)
+            self.assertEqual(expected.author(), article.author)
+            self.assertEqual(expected.contents(), article.contents)
+            self.assertEqual(expected.effective_text_rate(), article.text_rate)
+
+            # 釋放後仍然可以讀取已取得的欄位
+            self.assertEqual(expected.title(), nsoup.title())
+            self.assertEqual(expected.contents(10), nsoup.contents(10))
+            self.assertEqual(expected.effective_text_rate(), nsoup.effective_text_rate())
+            self.assertEqual(article, pickle.loads(pickle.dumps(article)))
+
+        self.assertIsNone(NewsSoup('/tmp/appledaily-notexisted.html').to_article())
+
+    def test_19_session_pool(self):
+        """
+        測試共用 session 的連線池，連線數上限、重試與統計
+        """
+        requested = []
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            第一次請求回應 503，之後都回應 200，保持連線
+            """
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                """
+                回應 GET 請求
+                """
+                # pylint: disable=invalid-name
+                requested.append(self.path)
+                status = 503 if len(requested) == 1 else 200
+                self.send_response(status)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args):
+                # pylint: disable=arguments-differ
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            """
+            多執行緒測試伺服器
+            """
+            daemon_threads = True
+
+        server = Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host = '127.0.0.1:{}'.format(server.server_address[1])
+        try:
+            twnews.common.set_pool_size(host, 2)
+            session = twnews.common.get_session(False)
+            url = 'http://{}/'.format(host)
+            with ThreadPoolExecutor(8) as executor:
+                statuses = list(executor.map(lambda i: session.get(url).status_code, range(40)))
+
+            # 503 由重試機制處理
+            self.assertEqual([200] * 40, statuses)
+            self.assertEqual(41, len(requested))
+
+            stats = twnews.common.pool_stats()[host]
+            self.assertEqual(41, stats['requests'])
+            self.assertLessEqual(stats['connections'], 2)
+            self.assertGreater(stats['reuse_rate'], 0.9)
+            self.assertGreater(stats['waits'], 0)
+
+            # 串流回應關閉之前都占用連線，重複關閉只釋放一次
+            slot = session.get_adapter(url).slots[host]
+            streams = [session.get(url, stream=True) for _ in range(2)]
+            self.assertFalse(slot.acquire(blocking=False))
+            streams[0].close()
+            streams[0].close()
+            self.assertTrue(slot.acquire(blocking=False))
+            slot.release()
+            streams[1].close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_20_async_session(self):
+        """
+        測試每個 event loop 各自的非同步 session，換 event loop 時不影響舊的 session
+        """
+        async def get_session():
+            return twnews.common.get_async_session(False)
+
+        old_loop = asyncio.new_event_loop()
+        new_loop = asyncio.new_event_loop()
+        try:
+            old_session = old_loop.run_until_complete(get_session())
+            session = new_loop.run_until_complete(get_session())
+            self.assertIsNot(old_session, session)
+            self.assertIs(session, new_loop.run_until_complete(get_session()))
+            self.assertIs(old_session, old_loop.run_until_complete(get_session()))
+            self.assertFalse(old_session.closed)
+
+            for (loop, loop_session) in [(old_loop, old_session), (new_loop, session)]:
+                loop.run_until_complete(twnews.common.close_async_session())
+                self.assertTrue(loop_session.closed)
+        finally:
+            old_loop.close()
+            new_loop.close()